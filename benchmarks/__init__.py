@@ -0,0 +1 @@
+""" ironoxide benchmarks, run from the repository root with python -m benchmarks.<name> """
@@ -0,0 +1,167 @@
+""" synthetic pdf corpus for the benchmarks: text layer, scanned and mixed documents, generated locally
+
+    python -m benchmarks.corpus [--out DIR] [--sizes 10 100 1000] [--kinds text scan mixed]
+
+    Pages are sentences of random words from a fixed vocabulary, one per line, with a running header and a page
+    number, so segmentation, boilerplate stripping and dedup all have work to do. Text pages are drawn in Helvetica,
+    scanned pages are the same text rasterized with PIL at SCAN_DPI, slightly rotated, thresholded and embedded
+    as grayscale images. Documents are deterministic for a given kind and size, and written once: later runs reuse them.
+"""
+import argparse
+import random
+import tempfile
+import zlib
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFont
+
+CORPUS_PATH = Path(tempfile.gettempdir())/'ironoxide-corpus'
+KINDS = ('text', 'scan', 'mixed')
+SIZES = (10, 100, 1000)
+SCAN_DPI = 200
+SCAN_ROTATION = 0.7  # degrees, so deskew has something to do
+MIXED_SCAN_EVERY = 3  # every third page of a mixed document is scanned
+PAGE_SIZE = (612, 792)  # letter, in points
+MARGIN = 72
+FONT_SIZE = 11
+LEADING = 14
+LINES_PER_PAGE = 40
+HEADER = 'Synthetic Course Book - Benchmark Edition'
+VOCABULARY = ('data', 'function', 'value', 'python', 'list', 'module', 'class', 'object', 'string', 'number', 'loop',
+              'variable', 'method', 'return', 'import', 'error', 'file', 'program', 'example', 'chapter', 'section',
+              'the', 'a', 'of', 'and', 'to', 'in', 'is', 'that', 'for', 'with', 'each', 'every', 'when', 'this',
+              'prints', 'reads', 'writes', 'calls', 'stores', 'changes', 'checks', 'uses', 'creates', 'shows')
+
+
+def page_lines(rng: random.Random, page_number: int) -> list:
+    lines = [HEADER, '']
+    for _ in range(LINES_PER_PAGE - 3):
+        words = [rng.choice(VOCABULARY) for _ in range(rng.randint(6, 12))]
+        lines.append(' '.join(words).capitalize() + '.')
+    lines.append(str(page_number))
+    return lines
+
+
+def page_texts(kind: str, pages: int) -> list:
+    """ Lines of each page of a corpus document, the same generate draws """
+    rng = random.Random(f'{kind}-{pages}')
+    return [page_lines(rng, page_number) for page_number in range(1, pages + 1)]
+
+
+def _escape(text: str) -> bytes:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)').encode('latin-1')
+
+
+def text_stream(lines: list) -> bytes:
+    """ Content stream drawing lines top to bottom in Helvetica """
+    parts = [f'BT /F1 {FONT_SIZE} Tf {LEADING} TL {MARGIN} {PAGE_SIZE[1] - MARGIN} Td'.encode()]
+    for line in lines:
+        parts.append(b"(" + _escape(line) + b") '")
+    parts.append(b'ET')
+    return b'\n'.join(parts)
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 only has the small bitmap font
+        return ImageFont.load_default()
+
+
+def scan_image(lines: list, dpi: int = SCAN_DPI) -> Image.Image:
+    """ The page as a grayscale scan: lines rasterized at dpi and rotated by SCAN_ROTATION """
+    scale = dpi / 72
+    image = Image.new('L', (round(PAGE_SIZE[0] * scale), round(PAGE_SIZE[1] * scale)), 255)
+    draw = ImageDraw.Draw(image)
+    font = _font(round(FONT_SIZE * scale))
+    for i, line in enumerate(lines):
+        draw.text((MARGIN * scale, (MARGIN + (i + 1) * LEADING - FONT_SIZE) * scale), line, fill=0, font=font)
+    return image.rotate(SCAN_ROTATION, resample=Image.BILINEAR, fillcolor=255).point(lambda level: 0 if level < 160 else 255)  # flat, like a scanner's output
+
+
+class PdfWriter:
+    """ Just enough of a pdf writer for the corpus: pages of Helvetica text or of one full-page grayscale image """
+
+    def __init__(self):
+        self.objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+        self.page_ids = []
+
+    def _add(self, obj: bytes) -> int:
+        self.objects.append(obj)
+        return len(self.objects)
+
+    def _stream(self, data: bytes, extra: str = '') -> int:
+        return self._add(f'<< /Length {len(data)} {extra}>>\nstream\n'.encode() + data + b'\nendstream')
+
+    def add_text_page(self, lines: list):
+        content = self._stream(zlib.compress(text_stream(lines)), '/Filter /FlateDecode ')
+        self.page_ids.append(self._add(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_SIZE[0]} {PAGE_SIZE[1]}] '
+                                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content} 0 R >>'.encode()))
+
+    def add_image_page(self, image: Image.Image):
+        xobject = self._stream(zlib.compress(image.tobytes()), f'/Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} '
+                                                                '/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode ')
+        content = self._stream(f'q {PAGE_SIZE[0]} 0 0 {PAGE_SIZE[1]} 0 0 cm /Im0 Do Q'.encode())
+        self.page_ids.append(self._add(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_SIZE[0]} {PAGE_SIZE[1]}] '
+                                       f'/Resources << /XObject << /Im0 {xobject} 0 R >> >> /Contents {content} 0 R >>'.encode()))
+
+    def save(self, path: Path):
+        self.objects[1] = f'<< /Type /Pages /Kids [{" ".join(f"{i} 0 R" for i in self.page_ids)}] /Count {len(self.page_ids)} >>'.encode()
+        out = bytearray(b'%PDF-1.4\n')
+        offsets = []
+        for number, obj in enumerate(self.objects, start=1):
+            offsets.append(len(out))
+            out += f'{number} 0 obj\n'.encode() + obj + b'\nendobj\n'
+        xref = len(out)
+        out += f'xref\n0 {len(self.objects) + 1}\n0000000000 65535 f \n'.encode()
+        out += b''.join(f'{offset:010d} 00000 n \n'.encode() for offset in offsets)
+        out += f'trailer\n<< /Size {len(self.objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_bytes(out)
+        tmp_path.replace(path)
+
+
+def is_scanned(kind: str, page_number: int) -> bool:
+    return kind == 'scan' or (kind == 'mixed' and page_number % MIXED_SCAN_EVERY == 0)
+
+
+def generate(kind: str, pages: int, out: Path = CORPUS_PATH) -> Path:
+    """ Writes (or reuses) the synthetic document of a kind and size
+
+        Args:
+            kind(str): one of KINDS
+            pages(int): page count
+            out(Path): corpus folder
+
+        Returns:
+            Path: the pdf
+    """
+    if kind not in KINDS:
+        raise ValueError(f'Unknown corpus kind {kind!r}, expected one of {KINDS}')
+    path = Path(out)/f'{kind}-{pages}.pdf'
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = PdfWriter()
+    for page_number, lines in enumerate(page_texts(kind, pages), start=1):
+        if is_scanned(kind, page_number):
+            writer.add_image_page(scan_image(lines))
+        else:
+            writer.add_text_page(lines)
+    writer.save(path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', type=Path, default=CORPUS_PATH)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    args = parser.parse_args()
+    for kind in args.kinds:
+        for pages in args.sizes:
+            print(generate(kind, pages, args.out))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+""" text layer backend benchmark: pages per second of each convert.get_text_backend, and how far its text is from the baseline's
+
+    python -m benchmarks.extract_backends [FILE.pdf ...] [--backends pdfplumber pdfminer ...] [--baseline pdfplumber] [--pages N] [--diff] [--json results.json]
+
+    Without files, the text and mixed documents of the synthetic corpus are used (--sizes). Similarity is difflib's
+    ratio between each page's text and the baseline backend's, whitespace collapsed, averaged over the pages, along
+    with the least similar page; --diff prints that page's differences. Backends whose package isn't installed are skipped.
+"""
+import argparse
+import difflib
+import json
+import time
+from contextlib import closing
+from pathlib import Path
+
+from benchmarks import corpus
+from ironoxide import convert
+
+BACKENDS = tuple(name for name in convert.TEXT_BACKENDS if name != 'fastest')
+DIFF_LINES = 20  # lines of each --diff shown
+
+
+def normalize(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def similarity(expected: str, actual: str) -> float:
+    """ difflib ratio of two page texts, ignoring differences in whitespace """
+    return difflib.SequenceMatcher(None, normalize(expected), normalize(actual)).ratio()
+
+
+def extract(file_path: Path, backend: str, pages: int = None) -> tuple:
+    """ (page texts, seconds) of the first pages of a pdf, opening it included """
+    start = time.perf_counter()
+    with closing(convert.get_text_backend(file_path, backend)) as pdf:
+        texts = [pdf.page_text(page_index) for page_index in range(min(len(pdf), pages or len(pdf)))]
+    return texts, time.perf_counter() - start
+
+
+def run(file_path: Path, backends: list, baseline: str, pages: int = None, show_diff: bool = False) -> list:
+    texts = {}
+    results = []
+    for backend in [baseline] + [backend for backend in backends if backend != baseline]:
+        texts[backend], seconds = extract(file_path, backend, pages)
+        page_count = len(texts[backend])
+        scores = [similarity(expected, actual) for expected, actual in zip(texts[baseline], texts[backend])]
+        worst = min(range(page_count), key=scores.__getitem__) if page_count else None
+        results.append({'file': str(file_path), 'backend': backend, 'pages': page_count, 'seconds': seconds,
+                        'pages_per_second': page_count / seconds if seconds else None,
+                        'similarity': sum(scores) / page_count if page_count else 1.0,
+                        'worst_page': worst + 1 if worst is not None else None, 'worst_similarity': scores[worst] if worst is not None else None})
+
+    base_seconds = results[0]['seconds']
+    print(f'\n{file_path.name} ({results[0]["pages"]} pages), similarity to {baseline}')
+    print(f'  {"backend":<12} {"pages/s":>9} {"speedup":>8} {"similarity":>11}  worst page')
+    for result in results:
+        worst = f'p.{result["worst_page"]} {result["worst_similarity"]:.2%}' if result['worst_page'] is not None else '-'
+        print(f'  {result["backend"]:<12} {result["pages_per_second"]:9.1f} {base_seconds / result["seconds"]:7.2f}x {result["similarity"]:11.2%}  {worst}')
+
+    if show_diff:
+        for result in results[1:]:
+            if result['worst_page'] is None or result['worst_similarity'] == 1.0:
+                continue
+            page_index = result['worst_page'] - 1
+            diff = difflib.unified_diff(texts[baseline][page_index].splitlines(), texts[result['backend']][page_index].splitlines(),
+                                        f'{baseline} p.{page_index + 1}', f'{result["backend"]} p.{page_index + 1}', lineterm='', n=0)
+            lines = list(diff)
+            print('\n'.join(lines[:DIFF_LINES]) + (f'\n... {len(lines) - DIFF_LINES} more lines' if len(lines) > DIFF_LINES else ''))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', type=Path, nargs='*', help='pdfs to extract, the synthetic corpus if none')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--baseline', choices=BACKENDS, default=convert.TEXT_BACKEND, help='backend the others are compared to')
+    parser.add_argument('--pages', type=int, default=None, help='only the first N pages of each pdf')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100], help='page counts of the corpus documents used without files')
+    parser.add_argument('--diff', action='store_true', help='print the differences on each backend\'s least similar page')
+    parser.add_argument('--json', type=Path, help='also write the results here')
+    args = parser.parse_args()
+
+    files = args.files or [corpus.generate(kind, size) for kind in ('text', 'mixed') for size in args.sizes]
+    backends = []
+    for backend in dict.fromkeys([args.baseline] + args.backends):
+        try:
+            extract(files[0], backend, pages=1)  # warm up: the first extraction pays for importing the backend
+        except ImportError:
+            print(f'skipping {backend}, its package is not installed')
+            continue
+        backends.append(backend)
+    if args.baseline not in backends:
+        parser.error(f'the baseline {args.baseline} is not installed')
+
+    results = []
+    for file_path in files:
+        results += run(file_path, backends, args.baseline, pages=args.pages, show_diff=args.diff)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
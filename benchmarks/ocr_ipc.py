@@ -0,0 +1,104 @@
+""" OCR handoff benchmark: bytes sent to the workers and wall time, pickled images through Pool.map against handoff
+
+    python -m benchmarks.ocr_ipc [--pages 32] [--dpi 200] [--color] [--processes 4] [--engine auto] [--no-preprocess] [--json results.json]
+
+    With --engine none, pages are synthetic letter size noise images and the workers only read every pixel once
+    (getextrema), so the timings measure the handoff itself. With an OCR engine (the default when tesseract is
+    installed) pages are scans of corpus text and go through convert's own OCR worker function, preprocessing and the
+    engine's file handling included: with --no-preprocess shared pages reach tesseract as the handoff's netpbm files.
+"""
+import argparse
+import json
+import pickle
+import random
+import shutil
+import time
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+
+from PIL import Image
+
+from benchmarks import corpus
+from ironoxide import convert, handoff, imaging, tesseract
+
+PAGE_INCHES = (8.5, 11)
+
+
+def synthetic_pages(count: int, dpi: int, color: bool, text: bool = False) -> list:
+    size = (int(PAGE_INCHES[0] * dpi), int(PAGE_INCHES[1] * dpi))
+    rng = random.Random(0)
+    pages = []
+    for i in range(count):
+        gray = corpus.scan_image(corpus.page_lines(rng, i + 1), dpi=dpi) if text else Image.effect_noise(size, 32 + i % 32)
+        pages.append(Image.merge('RGB', (gray, gray.rotate(180), gray.transpose(Image.FLIP_LEFT_RIGHT))) if color else gray)
+    return pages
+
+
+def _read_image(image) -> tuple:
+    return image.getextrema()
+
+
+def _read_shared(image: handoff.SharedImage) -> tuple:
+    with image.open() as page:
+        return page.getextrema()
+
+
+def _ocr_page(page, engine: str, preprocess: dict) -> str:
+    """ One page, a PIL image or a SharedImage, through convert's OCR worker function as iter_pages_ocr hands it over """
+    text, = convert._ocr_batch([page], engine=engine, **preprocess)
+    return text
+
+
+def run_pickled(pool, pages: list, work=_read_image) -> dict:
+    start = time.perf_counter()
+    pool.map(work, pages, chunksize=1)
+    seconds = time.perf_counter() - start
+    return {'method': 'pickle', 'seconds': seconds, 'ipc_bytes': sum(len(pickle.dumps(page)) for page in pages)}
+
+
+def run_handoff(pool, pages: list, work=_read_shared) -> dict:
+    with handoff.ImageHandoff() as shared:
+        start = time.perf_counter()
+        images = [shared.share(page) for page in pages]
+        pool.map(work, images, chunksize=1)
+        for image in images:
+            shared.release(image)
+        seconds = time.perf_counter() - start
+    return {'method': 'handoff', 'seconds': seconds, 'ipc_bytes': sum(len(pickle.dumps(image)) for image in images)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=32)
+    parser.add_argument('--dpi', type=int, default=imaging.OCR_DEFAULT_DPI)
+    parser.add_argument('--color', action='store_true', help='RGB pages instead of grayscale')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--engine', choices=tesseract.OCR_ENGINES + ('none',), default='auto' if shutil.which('tesseract') else 'none',
+                        help='OCR engine the workers run, none to only read the pixels; the default is auto when tesseract is installed')
+    parser.add_argument('--no-preprocess', action='store_true', help='OCR the pages as they are, without convert.OCR_OPTIONS preprocessing')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per method, the fastest is reported')
+    parser.add_argument('--json', type=Path, help='also write the results here')
+    args = parser.parse_args()
+
+    pages = synthetic_pages(args.pages, args.dpi, args.color, text=args.engine != 'none')
+    print(f'{args.pages} {pages[0].mode} pages of {pages[0].width}x{pages[0].height} at {args.dpi} dpi, {args.processes} processes, engine {args.engine}')
+    if args.engine == 'none':
+        work = {run_pickled: _read_image, run_handoff: _read_shared}
+    else:
+        preprocess = {step: False if args.no_preprocess else convert.OCR_OPTIONS[step] for step in ('grayscale', 'binarize', 'deskew')}
+        work = dict.fromkeys((run_pickled, run_handoff), partial(_ocr_page, engine=args.engine, preprocess=preprocess))
+    results = []
+    with Pool(processes=args.processes) as pool:
+        pool.map(_read_image, [Image.new('L', (1, 1))] * args.processes)  # start the workers before timing
+        for run in (run_pickled, run_handoff):
+            result = min((run(pool, pages, work[run]) for _ in range(args.repeat)), key=lambda x: x['seconds'])
+            results.append(result)
+            print(f'{result["method"]:<8} {result["seconds"]:7.3f}s  {result["ipc_bytes"]:>14,} bytes sent to workers')
+    print(f'handoff: {results[0]["seconds"] / results[1]["seconds"]:.2f}x faster, {results[0]["ipc_bytes"] / results[1]["ipc_bytes"]:.0f}x fewer bytes')
+    if args.json:
+        args.json.write_text(json.dumps({**vars(args), 'json': None, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+""" OCR preprocessing benchmark: seconds per page and character accuracy for each render DPI and preprocessing setting
+
+    python -m benchmarks.ocr_preprocess FILE.pdf [--truth FILE.txt] [--pages 5] [--dpi 150 200 300] [--json results.json]
+
+    Accuracy is measured against --truth (the expected text of the sampled pages, separated by form feeds) or, by
+    default, against the pdf's own text layer, so a born-digital pdf can stand in for a scan of itself.
+"""
+import argparse
+import difflib
+import itertools
+import json
+import time
+from pathlib import Path
+
+import pdfplumber
+from pdf2image import convert_from_path
+
+from ironoxide import convert, imaging
+
+PREPROCESS_STEPS = ('grayscale', 'binarize', 'deskew')
+
+
+def char_accuracy(expected: str, actual: str) -> float:
+    """ Share of matching characters between two texts, ignoring differences in whitespace """
+    expected, actual = ' '.join(expected.split()), ' '.join(actual.split())
+    if not expected:
+        return 1.0 if not actual else 0.0
+    matcher = difflib.SequenceMatcher(None, expected, actual, autojunk=False)
+    return sum(block.size for block in matcher.get_matching_blocks()) / max(len(expected), len(actual))
+
+
+def settings_grid(dpis: list) -> list:
+    """ Every DPI with no preprocessing, each step alone and all steps together """
+    combinations = [()] + [(step,) for step in PREPROCESS_STEPS] + [PREPROCESS_STEPS]
+    return [(dpi, {step: step in steps for step in PREPROCESS_STEPS}) for dpi, steps in itertools.product(dpis, combinations)]
+
+
+def run(file_path: Path, truths: list, dpis: list) -> list:
+    pages = len(truths)
+    results = []
+    for dpi, preprocess in settings_grid(dpis):
+        images = convert_from_path(file_path, first_page=1, last_page=pages, dpi=dpi, grayscale=preprocess['grayscale'])
+        start = time.perf_counter()
+        texts = [convert.ocr(image, **preprocess) for image in images]
+        seconds = (time.perf_counter() - start) / pages
+        accuracy = sum(char_accuracy(truth, text) for truth, text in zip(truths, texts)) / pages
+        steps = '+'.join(step for step in PREPROCESS_STEPS if preprocess[step]) or 'none'
+        results.append({'dpi': dpi, 'preprocess': steps, 'seconds_per_page': seconds, 'accuracy': accuracy})
+        print(f'{dpi:>4} dpi  {steps:<26} {seconds:7.3f}s/page  {accuracy:7.2%}')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('file', type=Path, help='pdf to OCR')
+    parser.add_argument('--truth', type=Path, help='expected text of the pages, separated by form feeds')
+    parser.add_argument('--pages', type=int, default=5, help='pages from the start of the pdf to OCR')
+    parser.add_argument('--dpi', type=int, nargs='+', default=[imaging.OCR_MIN_DPI, imaging.OCR_DEFAULT_DPI, imaging.OCR_MAX_DPI])
+    parser.add_argument('--json', type=Path, help='also write the results here')
+    args = parser.parse_args()
+
+    if args.truth:
+        truths = args.truth.read_text().split('\f')[:args.pages]
+    else:
+        with pdfplumber.open(args.file) as pdf:
+            truths = [page.extract_text() or '' for page in pdf.pages[:args.pages]]
+    print(f'auto DPI for {args.file}: {imaging.choose_dpi(args.file)}')
+    results = run(args.file, truths, args.dpi)
+
+    acceptable = [x for x in results if x['accuracy'] >= max(r['accuracy'] for r in results) - 0.01]
+    fastest = min(acceptable, key=lambda x: x['seconds_per_page'])
+    print(f'fastest within 1% of the best accuracy: {fastest["dpi"]} dpi, {fastest["preprocess"]}')
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+""" segmentation benchmark: ironoxide.segment against the original split/replace/clean_str post-processing
+
+    python -m benchmarks.segment [--text output.txt] [--repeat 20]
+"""
+import argparse
+import time
+import unicodedata
+from pathlib import Path
+
+from ironoxide import segment
+
+ROOT = Path(__file__).parent.parent
+
+
+def legacy_segments(pages: list, min_words=segment.MIN_WORDS, max_chars=segment.MAX_CHARS) -> list:
+    """ The post-processing convert.convert used to do, kept as the baseline """
+    fulltext = ''
+    for text in pages:
+        fulltext += text + '\n'
+    output = []
+    for sentence in fulltext.split('.\n'):
+        if len(sentence.replace('.', '').split(' ')) > min_words:
+            output.append(unicodedata.normalize('NFC', str(sentence[:max_chars].strip())))
+    return output
+
+
+def split_pages(text: str) -> list:
+    """ Splits the sample back into pages on its form feeds, or on the page number lines pdfplumber leaves behind """
+    if '\f' in text:
+        return text.split('\f')
+    pages, page = [], []
+    for line in text.split('\n'):
+        page.append(line)
+        if line.strip().isdigit():
+            pages.append('\n'.join(page))
+            page = []
+    pages.append('\n'.join(page))
+    return pages
+
+
+def best_of(function, pages, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(pages)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--text', default=ROOT/'output.txt', type=Path, help='extracted text to segment')
+    parser.add_argument('--repeat', default=20, type=int, help='runs per implementation, the best is reported')
+    args = parser.parse_args()
+
+    pages = split_pages(args.text.read_text())
+    expected = legacy_segments(pages)
+    actual = list(segment.iter_segments(pages))
+    assert actual == expected, 'segmenter output differs from the legacy post-processing'
+
+    size = sum(len(page) for page in pages)
+    legacy = best_of(legacy_segments, pages, args.repeat)
+    current = best_of(lambda x: list(segment.iter_segments(x)), pages, args.repeat)
+    print(f'{len(pages)} pages, {size} chars, {len(actual)} sentences (identical output)')
+    print(f'legacy:    {legacy * 1000:8.2f}ms  {size / legacy / 1e6:6.1f} MB/s')
+    print(f'segmenter: {current * 1000:8.2f}ms  {size / current / 1e6:6.1f} MB/s  ({legacy / current:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+""" benchmark suite: convert.convert end to end and stage by stage on the synthetic corpus, saved as json per commit
+
+    python -m benchmarks.suite [--sizes 10 100 1000] [--kinds text scan mixed] [--stages ...] [--compare OLD.json]
+
+    Stages:
+        convert    convert.convert end to end: 'text' mode for text documents, 'ocr' for scans, 'auto' for mixed ones
+        extract    text layer of every page (convert.iter_pages_text)
+        rasterize  every page rendered at the default OCR resolution (convert.iter_rendered_pages)
+        ocr        page texts in the document's convert mode, rasterization included (convert.iter_pages), not for text documents
+        segment    boilerplate stripping, segmentation and packing of the document's known page texts
+        write      writing the packed chunks of the document in each --formats
+
+    Every measurement runs in a fresh process, so peak RSS (of that process, and of the largest of its workers) is
+    the stage's own. Results go to benchmarks/results/<commit>.json unless --json says otherwise; --compare prints
+    the speedup of each measurement over an earlier results file.
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+from benchmarks import corpus
+
+ROOT = Path(__file__).parent.parent
+RESULTS_PATH = ROOT/'benchmarks'/'results'
+STAGES = ('convert', 'extract', 'rasterize', 'ocr', 'segment', 'write')
+CONVERT_MODES = {'text': 'text', 'scan': 'ocr', 'mixed': 'auto'}
+RSS_UNIT = 2**20 if sys.platform == 'darwin' else 2**10  # ru_maxrss is in bytes on macos, KiB elsewhere
+
+
+def missing_tools(stage: str, kind: str) -> list:
+    """ External programs a stage needs that aren't installed """
+    needed = []
+    if stage in ('rasterize', 'ocr') or (stage == 'convert' and kind != 'text'):
+        needed.append('pdftoppm')
+    if stage == 'ocr' or (stage == 'convert' and kind != 'text'):
+        needed.append('tesseract')
+    return [tool for tool in needed if shutil.which(tool) is None]
+
+
+def page_texts(kind: str, pages: int) -> list:
+    """ Text of each page of a corpus document, as it was generated """
+    return ['\n'.join(lines) for lines in corpus.page_texts(kind, pages)]
+
+
+def pack(texts: list) -> Iterator[str]:
+    """ What convert.iter_chunks does to page texts, without dedup """
+    from ironoxide import convert, segment
+    sentences = segment.iter_segments(convert.BoilerplateStripper()(texts), max_chars=None)
+    return segment.pack(sentences, budget=convert.PACK_BUDGET)
+
+
+def run_stage(stage: str, kind: str, pages: int, file_path: Path, formats: list) -> dict:
+    """ Times one stage on one document, run in its own process
+
+        Returns:
+            dict: seconds, pages, bytes_in, bytes_out (where it applies), and peak RSS in MiB
+    """
+    from ironoxide import convert, imaging, store
+
+    result = {'bytes_in': file_path.stat().st_size}
+    with tempfile.TemporaryDirectory(prefix='ironoxide_bench_') as tmp:
+        if stage == 'segment':
+            texts = page_texts(kind, pages)
+            result['bytes_in'] = sum(len(text.encode()) for text in texts)
+        if stage == 'write':
+            chunks = [{'text': chunk} for chunk in pack(page_texts(kind, pages))]
+
+        start = time.perf_counter()
+        if stage == 'convert':
+            output_path = convert.convert(file_path, mode=CONVERT_MODES[kind], use_cache=False, output_path=Path(tmp)/'output.jsonl')
+            result['bytes_out'] = output_path.stat().st_size
+        elif stage == 'extract':
+            result['bytes_out'] = sum(len(text.encode()) for text in convert.iter_pages_text(file_path))
+        elif stage == 'rasterize':
+            for _ in convert.iter_rendered_pages(file_path, dpi=imaging.OCR_DEFAULT_DPI, grayscale=True):
+                pass
+        elif stage == 'ocr':
+            result['bytes_out'] = sum(len(text.encode()) for text in convert.iter_pages(file_path, mode=CONVERT_MODES[kind]))
+        elif stage == 'segment':
+            result['bytes_out'] = sum(len(chunk.encode()) for chunk in pack(texts))
+        elif stage == 'write':
+            result['bytes_out'] = {}
+            for output_format in formats:
+                format_start = time.perf_counter()
+                output_path = Path(tmp)/f'output{store.FORMATS[output_format]}'
+                with store.open_writer(output_path, output_format) as writer:
+                    for chunk in chunks:
+                        writer.write(chunk)
+                result[f'seconds_{output_format}'] = time.perf_counter() - format_start
+                result['bytes_out'][output_format] = output_path.stat().st_size
+        else:
+            raise ValueError(f'Unknown stage {stage!r}, expected one of {STAGES}')
+        result['seconds'] = time.perf_counter() - start
+
+    result['pages'] = pages
+    result['pages_per_second'] = pages / result['seconds'] if result['seconds'] else None
+    result['peak_rss_mib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / RSS_UNIT
+    result['peak_worker_rss_mib'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / RSS_UNIT
+    return result
+
+
+def measure(stage: str, kind: str, pages: int, file_path: Path, formats: list) -> dict:
+    # a fresh spawned process per measurement, its workers are allowed to have children (unlike a Pool's)
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_stage, stage, kind, pages, file_path, formats).result()
+
+
+def git_commit() -> tuple:
+    """ (commit hash, True if the tree has uncommitted changes), (None, False) outside a git checkout """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, dirty
+
+
+def compare(results: list, baseline_path: Path):
+    baseline = {(x['stage'], x['kind'], x['pages']): x for x in json.loads(baseline_path.read_text())['results']}
+    print(f'\nagainst {baseline_path}:')
+    for result in results:
+        old = baseline.get((result['stage'], result['kind'], result['pages']))
+        if old is None or 'seconds' not in old or 'seconds' not in result:
+            continue
+        print(f'{result["stage"]:<10} {result["kind"]:<6} {result["pages"]:>5}p  {old["seconds"] / result["seconds"]:6.2f}x  '
+              f'peak RSS {old["peak_rss_mib"]:.0f} -> {result["peak_rss_mib"]:.0f} MiB')
+
+
+def main():
+    from ironoxide import store, workers
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(corpus.SIZES), help='document lengths in pages')
+    parser.add_argument('--kinds', nargs='+', choices=corpus.KINDS, default=list(corpus.KINDS))
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--formats', nargs='+', choices=list(store.FORMATS), default=['jsonl'], help='output formats timed by the write stage')
+    parser.add_argument('--corpus', type=Path, default=corpus.CORPUS_PATH, help='where the synthetic pdfs are generated and reused from')
+    parser.add_argument('--json', type=Path, help='results file, defaults to benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', type=Path, help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    report = {'commit': commit, 'dirty': dirty, 'python': platform.python_version(), 'platform': platform.platform(),
+              'cpus': workers.available_cpus(), 'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'results': []}
+    for kind in args.kinds:
+        for pages in args.sizes:
+            file_path = corpus.generate(kind, pages, args.corpus)
+            for stage in args.stages:
+                if stage == 'ocr' and kind == 'text':
+                    continue
+                entry = {'stage': stage, 'kind': kind, 'pages': pages}
+                missing = missing_tools(stage, kind)
+                if missing:
+                    entry['skipped'] = f'{", ".join(missing)} not installed'
+                    print(f'{stage:<10} {kind:<6} {pages:>5}p  skipped: {entry["skipped"]}')
+                else:
+                    entry.update(measure(stage, kind, pages, file_path, args.formats))
+                    print(f'{stage:<10} {kind:<6} {pages:>5}p  {entry["seconds"]:8.3f}s  {entry["pages_per_second"]:9.1f} pages/s  '
+                          f'peak RSS {entry["peak_rss_mib"]:6.0f} MiB (workers {entry["peak_worker_rss_mib"]:.0f})')
+                report['results'].append(entry)
+
+    json_path = args.json or RESULTS_PATH/f'{(commit or "unknown")[:12]}{"-dirty" if dirty else ""}.json'
+    json_path.parent.mkdir(parents=True, exist_ok=True)
+    json_path.write_text(json.dumps(report, indent=2))
+    print(f'saved {json_path}')
+    if args.compare:
+        compare(report['results'], args.compare)
+
+
+if __name__ == '__main__':
+    main()
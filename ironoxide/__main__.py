@@ -5,23 +5,124 @@ sys.dont_write_bytecode = True
 
 import os
 import argparse
+import logging
+import time
 
 # Django specific settings
 # https://github.com/dancaron/Django-ORM
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ironoxide.settings')
-import ironoxide.settings
-# import django
+import ironoxide.settings  # no django.setup() here, converting doesn't need the database, see settings.setup_django
 
-# django.setup()
+from ironoxide import batch, convert, metrics, search, workers
+
+PROGRESS_EVERY = 25  # pages between progress messages
+
+logger = logging.getLogger(__file__)
+logger.setLevel(ironoxide.settings.LOGGING_LEVEL_MODULE)
+
+
+def report_progress(pages: int):
+    """ Progress callback for convert.convert """
+    if pages % PROGRESS_EVERY == 0:
+        logger.info(f'{pages} pages extracted')
+
+
+def convert_options(args: argparse.Namespace) -> dict:
+    """ Keyword arguments for convert.convert from the parsed command line """
+    return {
+        'processes': args.processes,
+        'mode': args.mode,
+        'text_backend': args.text_backend,
+        'use_cache': not args.no_cache,
+        'output_format': args.format,
+        'strip_boilerplate': not args.keep_boilerplate,
+        'dedup': not args.no_dedup,
+        'dedup_scope': args.dedup_scope,
+        'pack_budget': args.chunk_budget,
+        'pack_overlap': args.chunk_overlap,
+        'pack_unit': args.chunk_unit,
+        'index_course': args.index,
+        'profile': args.profile,
+        'trace_memory': args.trace_memory,
+        'flamegraph': args.flamegraph,
+        'ocr_options': {'engine': args.ocr_engine, 'dpi': args.dpi, **({'grayscale': False, 'binarize': False, 'deskew': False} if args.no_preprocess else {})},
+    }
+
+
+def upload_options(args: argparse.Namespace) -> dict:
+    """ convert_options of a queued textbook job, without the ones models.Course.sync_textbook sets for every course """
+    options = convert_options(args)
+    for name in ('output_format', 'dedup_scope', 'index_course'):
+        del options[name]
+    return options
+
+
+def write_metrics(run_metrics: metrics.Metrics, args: argparse.Namespace):
+    """ Writes the --metrics json report and --prometheus textfile asked for """
+    if args.metrics:
+        run_metrics.write_json(args.metrics)
+    if args.prometheus:
+        run_metrics.write_prometheus(args.prometheus)
+
+
+def print_hits(hits: list, seconds: float):
+    """ Prints search results, best first """
+    for rank, hit in enumerate(hits, start=1):
+        print(f'{rank:>2}. {hit["path"] or hit["source"]} p. {hit["page"]} (course {hit["course"]}, score {hit["score"]:.2f})')
+        print(f'    {" ".join(hit["snippet"].split())}')
+    print(f'{len(hits)} results in {seconds * 1000:.1f} ms')
+
+
+def print_job(job):
+    """ Prints one line of a job's state """
+    timing = f', {job.seconds:.1f}s' if job.seconds is not None else ''
+    error = f': {job.error}' if job.error else ''
+    print(f'job {job.id} {job.state} (course {job.course.iu_id}, attempt {job.attempts}{timing}) {job.file_path}{error}')
 
-from ironoxide import convert
 
 def cli(args: argparse.Namespace):
     """
     This is the main function that will be called when the script is run.
     """
 
-    if args.convert:
+    job_ids = None  # jobs queued by this run, for --wait
+    if args.upload or args.work or args.job_status is not None or args.wait:
+        # the job queue lives in the django database
+        from ironoxide import jobs
+        from ironoxide.models import Course, Job
+
+    if args.convert and args.upload:
+        job_ids = [Course.objects.get(iu_id=args.upload).upload(args.convert, upload_options(args)).id]
+        print(f'Queued job {job_ids[0]}')
+    elif args.convert:
         # path should already be validated
-        convert.convert(args.convert)
-        # upload and associate with course
\ No newline at end of file
+        run_metrics = metrics.Metrics('convert')
+        with workers.WorkerPool(args.ocr_processes) as ocr_pool:
+            convert.convert(args.convert, output_path=args.output, ocr_pool=ocr_pool, progress=report_progress, run_metrics=run_metrics, **convert_options(args))
+        write_metrics(run_metrics, args)
+        # upload and associate with course
+
+    if args.batch:
+        run_metrics = metrics.Metrics('batch')
+        summary = batch.run(args.batch, jobs=args.jobs, output_dir=args.output_dir or batch.BATCH_PATH, ocr_processes=args.ocr_processes,
+                            run_metrics=run_metrics, **convert_options(args))
+        batch.print_summary(summary)
+        write_metrics(run_metrics, args)
+
+    if args.search:
+        start = time.perf_counter()
+        hits = search.search(args.search, course=args.course, limit=args.limit)
+        print_hits(hits, time.perf_counter() - start)
+
+    if args.work:
+        summary = jobs.work(concurrency=args.jobs, until_empty=args.until_empty, ocr_processes=args.ocr_processes)
+        print(f'Jobs done {summary["done"]}, requeued {summary["requeued"]}, failed {summary["failed"]}')
+
+    if args.job_status is not None:
+        queryset = Job.objects.select_related('course')
+        for job in (queryset.filter(id__in=args.job_status) if args.job_status else queryset.order_by('-id')[:20]):
+            print_job(job)
+
+    if args.wait:
+        finished = jobs.wait_for(job_ids, report=print_job)
+        print(f'{sum(job.state == Job.DONE for job in finished)} of {len(finished)} jobs done')
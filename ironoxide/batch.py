@@ -0,0 +1,145 @@
+""" resumable batch conversion of many pdfs """
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from ironoxide import convert, metrics, settings, store, workers
+
+logger = logging.getLogger(__file__)
+logger.setLevel(settings.LOGGING_LEVEL_MODULE)
+
+BATCH_PATH = settings.DATA_PATH/'batch'
+
+
+def find_pdfs(sources: list) -> list:
+    """ Expands files, directories (searched recursively) and glob patterns into a sorted list of pdf paths
+
+        Args:
+            sources(list): paths or glob patterns
+
+        Returns:
+            list[Path]: absolute paths of the pdfs found, without duplicates
+    """
+    found = set()
+    for source in sources:
+        if os.path.isdir(source):
+            found.update(Path(source).rglob('*.pdf'))
+        elif os.path.isfile(source):
+            found.add(Path(source))
+        else:
+            found.update(Path(x) for x in glob.glob(source, recursive=True) if x.lower().endswith('.pdf'))
+    return sorted(path.resolve() for path in found)
+
+
+class Manifest:
+    """ Progress of a batch, one entry per source pdf, saved as json after every document so a run can resume """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.entries = json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    @staticmethod
+    def fingerprint(file_path: Path) -> str:
+        stat = file_path.stat()
+        return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+    def is_done(self, file_path: Path) -> bool:
+        """ True if file_path was converted in an earlier run and hasn't changed since """
+        entry = self.entries.get(str(file_path))
+        return entry is not None and entry['status'] == 'done' and entry['fingerprint'] == self.fingerprint(file_path) and Path(entry['output']).exists()
+
+    def record(self, file_path: Path, **entry):
+        self.entries[str(file_path)] = {'fingerprint': self.fingerprint(file_path), **entry}
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.entries, indent=2))
+        os.replace(tmp_path, self.path)
+
+
+def _convert_one(file_path: Path, output_path: Path, options: dict) -> dict:
+    """ Converts a single pdf, run in a batch worker process """
+    start = time.perf_counter()
+    run_metrics = metrics.Metrics('convert')
+    convert.convert(file_path, output_path=output_path, ocr_pool=workers.job_pool(), run_metrics=run_metrics, **options)
+    # pages run through the conversion, none when the whole output came from the document cache
+    return {'pages': run_metrics.counters['pages'], 'cached': run_metrics.counters['document_cache_hits'] > 0,
+            'seconds': time.perf_counter() - start, 'metrics': run_metrics.report()}
+
+
+def run(sources: list, jobs=1, output_dir: Path = BATCH_PATH, ocr_processes: int = None, run_metrics: metrics.Metrics = None, **options) -> dict:
+    """ Converts every pdf found in sources, jobs at a time, skipping the ones a previous run already finished
+
+        Each job keeps one OCR pool for all the documents it converts, so OCR workers and their tesseract engines are
+        started once per batch rather than once per document.
+
+        Args:
+            sources(list): files, directories or glob patterns, see find_pdfs
+            jobs(int): number of documents converted concurrently
+            output_dir(Path): where the outputs and manifest.json are written
+            ocr_processes(int): OCR worker processes per job, None to split workers.available_cpus() between the jobs
+            run_metrics(metrics.Metrics): adds up the stage times and counters of every document converted, each
+                document's own are in the manifest
+            **options: passed on to convert.convert (mode, processes, use_cache, output_format)
+
+        Returns:
+            dict: summary with counts of converted, cached, skipped and failed documents, and the pages and pages per
+                second of the converted ones, documents copied from the document cache aren't in them
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(output_dir/'manifest.json')
+
+    file_paths = find_pdfs(sources)
+    todo = [file_path for file_path in file_paths if not manifest.is_done(file_path)]
+    logger.info(f'Converting {len(todo)} of {len(file_paths)} pdfs with {jobs} jobs, {len(file_paths) - len(todo)} already done')
+    ocr_processes = ocr_processes or max(1, workers.available_cpus() // jobs)
+
+    start = time.perf_counter()
+    summary = {'converted': 0, 'cached': 0, 'skipped': len(file_paths) - len(todo), 'failed': {}, 'pages': 0}
+    with ProcessPoolExecutor(max_workers=jobs, initializer=workers.init_job_pool, initargs=(ocr_processes,)) as executor:
+        futures = {}
+        for file_path in todo:
+            output_path = output_dir/store.output_name(file_path, options.get('output_format') or 'jsonl')
+            futures[executor.submit(_convert_one, file_path, output_path, options)] = (file_path, output_path)
+
+        try:
+            for future in as_completed(futures):
+                file_path, output_path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.exception(f'Failed to convert {file_path}')
+                    manifest.record(file_path, status='failed', output=str(output_path), error=repr(e))
+                    summary['failed'][str(file_path)] = repr(e)
+                    if run_metrics is not None:
+                        run_metrics.count('documents_failed')
+                    continue
+                manifest.record(file_path, status='done', output=str(output_path), **result)
+                if run_metrics is not None:
+                    run_metrics.merge(result['metrics'])
+                    run_metrics.count('documents')
+                if result['cached']:
+                    summary['cached'] += 1
+                    logger.debug(f'Copied {file_path} from the cache in {result["seconds"]:.3f}s')
+                    continue
+                summary['converted'] += 1
+                summary['pages'] += result['pages']
+                logger.debug(f'Converted {file_path} ({result["pages"]} pages) in {result["seconds"]:.3f}s')
+        except KeyboardInterrupt:
+            # finished documents are already in the manifest, the next run picks up the rest
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    summary['seconds'] = time.perf_counter() - start
+    summary['pages_per_second'] = summary['pages'] / summary['seconds'] if summary['seconds'] else 0.0
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f'Converted {summary["converted"]} pdfs ({summary["pages"]} pages) in {summary["seconds"]:.1f}s, '
+          f'{summary["pages_per_second"]:.2f} pages/s, cached {summary["cached"]}, skipped {summary["skipped"]}, failed {len(summary["failed"])}')
+    for file_path, error in summary['failed'].items():
+        print(f'  failed: {file_path}: {error}')
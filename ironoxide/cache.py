@@ -0,0 +1,147 @@
+""" content-addressed conversion cache for whole documents and single pages """
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+from ironoxide import settings, sqlitedb
+
+logger = logging.getLogger(__file__)
+logger.setLevel(settings.LOGGING_LEVEL_MODULE)
+
+CACHE_PATH = settings.DATA_PATH/'cache'
+CACHE_MAX_BYTES = 1024**3  # total size of cached documents and pages before the least recently used are evicted
+CACHE_COMMIT_EVERY = 32  # page texts stored between commits, a page OCR'd before a crash is only kept once committed
+
+
+def file_hash(file_path, block_size=1024**2) -> str:
+    """ sha256 hex digest of a file, read in blocks
+
+        Args:
+            file_path(PosixPath, str): path of the file to hash
+
+        Returns:
+            str: hex digest
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def copy_into_place(source, path):
+    """ Copies source to a temporary file next to path then renames it over path, like store.AtomicWriter
+
+        Readers of path see either its previous content or the whole copy, never a partial one.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp')
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def make_key(content_hash: str, **params) -> str:
+    """ cache key of some content converted with the given parameters
+
+        Args:
+            content_hash(str): hash of the document or page
+            **params: conversion parameters that change the output (mode, segment.MIN_WORDS, ..)
+
+        Returns:
+            str: hex digest
+    """
+    return hashlib.sha256((content_hash + json.dumps(params, sort_keys=True)).encode()).hexdigest()
+
+
+class ConversionCache:
+    """ Conversion outputs (jsonl or other store formats) and page texts, keyed by content hash, evicted least recently used first
+
+        Entries are indexed in a sqlite database in the cache directory. Document outputs are stored as files next to it,
+        page texts inline. Use as a context manager to commit new entries and evict down to max_bytes on exit.
+    """
+
+    def __init__(self, path: Path = CACHE_PATH, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        (self.path/'documents').mkdir(parents=True, exist_ok=True)
+        self.db = sqlitedb.connect(self.path/'index.sqlite3')
+        self._commits = sqlitedb.BatchedCommits(self.db, CACHE_COMMIT_EVERY)
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, kind TEXT NOT NULL, size INTEGER NOT NULL, used_at REAL NOT NULL, text TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_used_at ON entries (used_at)')
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _document_path(self, key: str) -> Path:
+        return self.path/'documents'/key
+
+    def get_document(self, key: str, output_path: Path) -> bool:
+        """ Copies the cached output of key to output_path, returns False on a miss """
+        document_path = self._document_path(key)
+        row = self.db.execute("SELECT 1 FROM entries WHERE key = ? AND kind = 'document'", (key,)).fetchone()
+        if row is None or not document_path.exists():
+            return False
+        copy_into_place(document_path, output_path)
+        self.db.execute('UPDATE entries SET used_at = ? WHERE key = ?', (time.time(), key))
+        self.db.commit()
+        return True
+
+    def put_document(self, key: str, output_path: Path):
+        """ Stores a copy of the converted output under key """
+        document_path = self._document_path(key)
+        copy_into_place(output_path, document_path)  # a concurrent get_document of the same key may be reading it
+        self.db.execute("INSERT OR REPLACE INTO entries (key, kind, size, used_at) VALUES (?, 'document', ?, ?)", (key, document_path.stat().st_size, time.time()))
+        self.db.commit()
+
+    def get_pages(self, keys: list) -> dict:
+        """ Looks up page texts, returns {key: text} of the hits """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for start in range(0, len(unique_keys), 500):  # stay below sqlite's bound parameter limit
+            batch = unique_keys[start:start + 500]
+            rows = self.db.execute(f"SELECT key, text FROM entries WHERE kind = 'page' AND key IN ({','.join('?' * len(batch))})", batch)
+            found.update(rows)
+        if found:
+            self.db.executemany('UPDATE entries SET used_at = ? WHERE key = ?', [(time.time(), key) for key in found])
+            self.db.commit()
+        return found
+
+    def put_page(self, key: str, text: str):
+        """ Stores a page text under key """
+        self.db.execute("INSERT OR REPLACE INTO entries (key, kind, size, used_at, text) VALUES (?, 'page', ?, ?, ?)", (key, len(text.encode()), time.time(), text))
+        self._commits.wrote()
+
+    def evict(self):
+        """ Removes least recently used entries until the cache fits in max_bytes """
+        total, = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, kind, size in self.db.execute('SELECT key, kind, size FROM entries ORDER BY used_at').fetchall():
+            if total <= self.max_bytes:
+                break
+            if kind == 'document':
+                self._document_path(key).unlink(missing_ok=True)
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+            evicted += 1
+        self.db.commit()
+        logger.debug(f'Evicted {evicted} cache entries')
+
+    def close(self):
+        self.db.commit()
+        self.evict()
+        self.db.close()
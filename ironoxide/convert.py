@@ -1,14 +1,37 @@
-import json
+import hashlib
+import importlib.util
 import logging
-import time
+import os
+import re
+import tempfile
+import threading
+from collections import Counter, deque
+from contextlib import ExitStack, closing, nullcontext
+from functools import partial
 from multiprocessing.pool import Pool
 from pathlib import Path
+from typing import Iterable, Iterator
 
-import pdfplumber
-import pytesseract
-from pdf2image import convert_from_path
+from ironoxide import cache, metrics, profiling, search, segment, settings, store, utils, workers
+# by name, convert's dedup argument shadows the module
+from ironoxide.dedup import (DEDUP_BANDS, DEDUP_PATH, DEDUP_ROWS, DEDUP_SEED, DEDUP_SHINGLE, DEDUP_SIGNATURE_VERSION, DEDUP_THRESHOLD,
+                             DedupIndex)
 
-from ironoxide import settings, utils
+# imported on first use, so a text conversion doesn't pay for the OCR libraries and --help for none of them
+pdfplumber = utils.lazy_import('pdfplumber')
+pdftypes = utils.lazy_import('pdfminer.pdftypes')
+pdfparser = utils.lazy_import('pdfminer.pdfparser')
+pdfdocument = utils.lazy_import('pdfminer.pdfdocument')
+pdfpage = utils.lazy_import('pdfminer.pdfpage')
+pdfinterp = utils.lazy_import('pdfminer.pdfinterp')
+pdfconverter = utils.lazy_import('pdfminer.converter')
+pdflayout = utils.lazy_import('pdfminer.layout')
+pdf2image = utils.lazy_import('pdf2image')
+pytesseract = utils.lazy_import('pytesseract')
+Image = utils.lazy_import('PIL.Image')
+handoff = utils.lazy_import('ironoxide.handoff')
+imaging = utils.lazy_import('ironoxide.imaging')
+tesseract = utils.lazy_import('ironoxide.tesseract')
 
 HERE = Path(__file__).parent
 
@@ -16,61 +39,876 @@ logging.getLogger('pdfminer').setLevel(logging.WARNING)  # for some reason it lo
 logger = logging.getLogger(__file__)
 logger.setLevel(settings.LOGGING_LEVEL_MODULE)
 
+OUTPUT_PATH = settings.DATA_PATH/'output'  # where outputs go when no output_path is given, named after their pdf
+PACK_BUDGET = segment.MAX_CHARS  # size of packed chunks, see segment.pack
+RENDER_WINDOW = 4  # pages rasterized per pdf2image call
+RENDER_AHEAD = 2  # windows rendered ahead of the OCR workers
+OCR_BATCH = 4  # max pages per OCR task, the batch engine runs one tesseract process for each
+OCR_AHEAD = 2  # OCR tasks queued per worker process
+OCR_OPTIONS = {  # defaults of the ocr_options argument
+    'engine': 'auto',  # see tesseract.get_engine
+    'dpi': 'auto',  # render DPI, 'auto' picks it from the scan resolution, see imaging.choose_dpi
+    'grayscale': True,  # preprocessing steps, see imaging.preprocess
+    'binarize': True,
+    'deskew': True,
+}
+MODES = ('text', 'ocr', 'auto')
+TEXT_BACKENDS = ('pdfplumber', 'pdfminer', 'pypdfium2', 'pymupdf', 'fastest')  # see get_text_backend
+TEXT_BACKEND = 'pdfplumber'  # default text layer backend of the 'text' and 'auto' modes
+TEXT_BACKEND_PREFERENCE = ('pypdfium2', 'pymupdf', 'pdfminer')  # what 'fastest' picks from, the first one installed
+PDFMINER_LAPARAMS = {  # layout analysis of the pdfminer backend, cheaper than pdfplumber's
+    'boxes_flow': None,  # text boxes in plain reading order, skips the hierarchical grouping of boxes that costs the most
+    'detect_vertical': False,
+    'all_texts': False,  # no text inside figures
+}
+AUTO_MIN_CHARS = 20  # pages with fewer text layer chars than this are OCR'd in auto mode
+AUTO_IMAGE_COVERAGE = 0.6  # pages mostly covered by images are OCR'd in auto mode..
+AUTO_SCAN_MAX_CHARS = 200  # ..unless they carry more text than a stamp or page number (e.g. already OCR'd scans)
+BOILERPLATE_EDGE_LINES = 4  # non-empty lines at the top and at the bottom of a page that can be running headers or footers
+BOILERPLATE_WINDOW = 16  # pages around a page over which its header and footer lines are counted
+BOILERPLATE_MIN_FRACTION = 0.3  # share of those pages a line has to recur on to be dropped..
+BOILERPLATE_MIN_PAGES = 3  # ..and at least this many
 
-def ocr(image):
-    return pytesseract.image_to_string(image, lang='eng', config=f"--oem 1")
 
+def ocr(image, grayscale=False, binarize=False, deskew=False):
+    """ OCRs a page image, or the path to one, with tesseract after the imaging.preprocess steps asked for """
+    if grayscale or binarize or deskew:
+        if isinstance(image, (str, Path)):
+            image = Image.open(image)
+        image = imaging.preprocess(image, grayscale=grayscale, binarize=binarize, deskew=deskew)
+    return pytesseract.image_to_string(image, lang=tesseract.OCR_LANG, config=f"--oem {tesseract.OCR_OEM}")
 
-def convert(file_path, ocr=False) -> Path:
-    """ Converts a pdf to a jsonl file
+
+_worker_engines = {}  # tesseract engines of an OCR worker process by name, loaded on first use and kept for the next tasks
+
+
+def _worker_engine(name: str):
+    if name not in _worker_engines:
+        _worker_engines[name] = tesseract.get_engine(name)
+    return _worker_engines[name]
+
+
+def _ocr_batch(pages: list, engine='auto', remove=False, grayscale=False, binarize=False, deskew=False) -> list:
+    """ OCRs a batch of rendered pages, run in an OCR worker process
+
+    Args:
+        pages (list): PIL images, handoff.SharedImages or paths of rendered pages
+        engine (str, optional): tesseract engine, kept loaded in the worker, see tesseract.get_engine. Defaults to 'auto'.
+        remove (bool, optional): Delete the image files afterwards. Defaults to False.
+        grayscale, binarize, deskew (bool, optional): imaging.preprocess steps. Default to False.
+
+    Returns:
+        list: OCR'd text of each page
+    """
+    try:
+        with ExitStack() as stack:
+            preprocessing = grayscale or binarize or deskew
+            images = []
+            for page in pages:
+                if isinstance(page, handoff.SharedImage):
+                    # a netpbm page needing no preprocessing goes to the engine as a path, tesseract reads it as it is
+                    page = page.path if page.netpbm and not preprocessing else stack.enter_context(page.open())
+                images.append(page)
+            if preprocessing:
+                images = [imaging.preprocess(Image.open(image) if isinstance(image, (str, Path)) else image, grayscale=grayscale, binarize=binarize, deskew=deskew)
+                          for image in images]
+            return _worker_engine(engine).recognize(images)
+    finally:
+        if remove:
+            for image_path in pages:
+                if isinstance(image_path, (str, Path)):
+                    os.remove(image_path)
+
+
+def ocr_settings(file_path, ocr_options: dict = None) -> tuple:
+    """ Resolves ocr_options over OCR_OPTIONS for a pdf
 
     Args:
         file_path (PosixPath, str): Absolute path to the pdf file
-        ocr (bool, optional): If the OCR method should be used to extract text instead of the pdfminer method. Defaults to False.
+        ocr_options (dict, optional): Overrides of OCR_OPTIONS. Defaults to None.
 
     Returns:
-        Path: Absolute path to the output jsonl file
+        tuple: (tesseract engine name, render DPI, keyword arguments for imaging.preprocess)
     """
+    preprocess = {**OCR_OPTIONS, **(ocr_options or {})}
+    engine = preprocess.pop('engine')
+    dpi = preprocess.pop('dpi')
+    if dpi == 'auto':
+        dpi = imaging.choose_dpi(file_path)
+    return engine, int(dpi), preprocess
 
-    logger.info(f'Converting {file_path} to jsonl')
 
-    MIN_WORDS = 5
-    MAX_CHARS = 2000
-    OCR_PROCESSES = 8
+class PdfplumberBackend:
+    """ pdfplumber's extract_text: full layout analysis of every char, the slowest but the original text """
+
+    def __init__(self, file_path):
+        self.pdf = pdfplumber.open(file_path)
+
+    def __len__(self) -> int:
+        return len(self.pdf.pages)
+
+    def page_text(self, page_index: int) -> str:
+        page = self.pdf.pages[page_index]
+        text = page.extract_text() or ''
+        page.close()
+        return text
+
+    def close(self):
+        self.pdf.close()
+
+
+class PdfminerBackend:
+    """ pdfminer's layout analysis straight into text boxes with PDFMINER_LAPARAMS, without pdfplumber's objects """
+
+    def __init__(self, file_path):
+        self.file = open(file_path, 'rb')
+        try:
+            document = pdfdocument.PDFDocument(pdfparser.PDFParser(self.file))
+            self.pages = list(pdfpage.PDFPage.create_pages(document))
+        except Exception:
+            self.file.close()
+            raise
+        resources = pdfinterp.PDFResourceManager(caching=True)
+        self.device = pdfconverter.PDFPageAggregator(resources, laparams=pdflayout.LAParams(**PDFMINER_LAPARAMS))
+        self.interpreter = pdfinterp.PDFPageInterpreter(resources, self.device)
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def page_text(self, page_index: int) -> str:
+        self.interpreter.process_page(self.pages[page_index])
+        layout = self.device.get_result()
+        return ''.join(item.get_text() for item in layout if isinstance(item, pdflayout.LTTextContainer)).rstrip('\n')
+
+    def close(self):
+        self.file.close()
+
+
+class Pypdfium2Backend:
+    """ PDFium's text extraction in C through the optional pypdfium2 package, orders of magnitude faster """
+
+    def __init__(self, file_path):
+        import pypdfium2
+        self.pdf = pypdfium2.PdfDocument(file_path)
+
+    def __len__(self) -> int:
+        return len(self.pdf)
+
+    def page_text(self, page_index: int) -> str:
+        page = self.pdf[page_index]
+        try:
+            text_page = page.get_textpage()
+            text = text_page.get_text_range()
+            text_page.close()
+        finally:
+            page.close()
+        return text.replace('\r\n', '\n')
+
+    def close(self):
+        self.pdf.close()
+
+
+class PymupdfBackend:
+    """ MuPDF's text extraction in C through the optional PyMuPDF package """
+
+    def __init__(self, file_path):
+        import fitz
+        self.pdf = fitz.open(file_path)
+
+    def __len__(self) -> int:
+        return len(self.pdf)
+
+    def page_text(self, page_index: int) -> str:
+        return self.pdf.load_page(page_index).get_text('text').rstrip('\n')
+
+    def close(self):
+        self.pdf.close()
+
+
+_TEXT_BACKEND_CLASSES = {'pdfplumber': PdfplumberBackend, 'pdfminer': PdfminerBackend, 'pypdfium2': Pypdfium2Backend, 'pymupdf': PymupdfBackend}
+_TEXT_BACKEND_MODULES = {'pypdfium2': 'pypdfium2', 'pymupdf': 'fitz'}  # optional packages a backend needs
+
+
+def resolve_text_backend(name: str = TEXT_BACKEND) -> str:
+    """ The backend name is checked, and 'fastest' replaced by the first installed backend of TEXT_BACKEND_PREFERENCE """
+    if name == 'fastest':
+        return next(backend for backend in TEXT_BACKEND_PREFERENCE
+                    if backend not in _TEXT_BACKEND_MODULES or importlib.util.find_spec(_TEXT_BACKEND_MODULES[backend]) is not None)
+    if name not in _TEXT_BACKEND_CLASSES:
+        raise ValueError(f'Unknown text backend {name!r}, expected one of {TEXT_BACKENDS}')
+    return name
+
+
+def get_text_backend(file_path, name: str = TEXT_BACKEND):
+    """ Opens a pdf with a text layer backend
+
+    Backends give the same lines of text for simple layouts but differ on columns, tables and spacing, see
+    benchmarks/extract_backends.py for how much and how fast.
+
+    Args:
+        file_path (PosixPath, str): Absolute path to the pdf file
+        name (str, optional): One of TEXT_BACKENDS: 'pdfplumber', 'pdfminer' (tuned by PDFMINER_LAPARAMS), 'pypdfium2'
+            or 'pymupdf' (optional packages), or 'fastest' for the first one installed of TEXT_BACKEND_PREFERENCE. Defaults to TEXT_BACKEND.
+
+    Returns:
+        backend with len() pages, page_text(page_index) -> str and close(), closed by closing()
+    """
+    return _TEXT_BACKEND_CLASSES[resolve_text_backend(name)](file_path)
+
+
+_worker_pdf = None  # (path, backend name, backend) opened by a text extraction worker, reused across its page ranges
+
+
+def _worker_open(file_path, text_backend: str):
+    """ Opens file_path in a worker process, keeping it open for the next range of the same file """
+    global _worker_pdf
+    if _worker_pdf is None or _worker_pdf[:2] != (str(file_path), text_backend):
+        if _worker_pdf is not None:
+            _worker_pdf[2].close()
+        _worker_pdf = (str(file_path), text_backend, get_text_backend(file_path, text_backend))
+    return _worker_pdf[2]
+
+
+def _extract_page_range(task) -> list:
+    """ Extracts the text of a range of page indices of a pdf, run in a worker process """
+    file_path, text_backend, page_indices = task
+    pdf = _worker_open(file_path, text_backend)
+    return [pdf.page_text(page_index) for page_index in page_indices]
+
+
+def page_ranges(page_indices: list, processes: int, ranges_per_process: int = 4) -> list:
+    """ Splits page indices into contiguous ranges, a few per process so slow pages don't stall a worker """
+    size = max(1, -(-len(page_indices) // (processes * ranges_per_process)))
+    return [page_indices[start:start + size] for start in range(0, len(page_indices), size)]
+
+
+def ocr_batch_size(page_count: int, processes: int) -> int:
+    """ Pages per OCR task: OCR_BATCH, or fewer so a short document still gives every worker a couple of tasks """
+    return max(1, min(OCR_BATCH, -(-page_count // (processes * OCR_AHEAD))))
+
+
+def _page_runs(page_numbers: Iterable[int], window: int) -> Iterator[tuple]:
+    """ Groups ascending 1-based page numbers into (first_page, last_page) runs of consecutive pages, at most window long """
+    first_page = last_page = None
+    for page_number in page_numbers:
+        if first_page is not None and page_number == last_page + 1 and page_number - first_page < window:
+            last_page = page_number
+            continue
+        if first_page is not None:
+            yield first_page, last_page
+        first_page = last_page = page_number
+    if first_page is not None:
+        yield first_page, last_page
+
+
+def iter_pages_text(file_path, processes=1, pages=None, text_backend=TEXT_BACKEND) -> Iterator[str]:
+    """ Yields the text layer of each page of a pdf, one page at a time
+
+    Each page's parsed objects and layout are dropped as soon as its text has been read,
+    so memory does not grow with the length of the document.
+
+    Args:
+        file_path (PosixPath, str): Absolute path to the pdf file
+        processes (int, optional): Number of worker processes. Above 1 the pdf is split into page ranges that
+            each worker opens separately, results are merged back in page order. Defaults to 1.
+        pages (list, optional): Sorted 0-based indices of the pages to extract, None for all. Defaults to None.
+        text_backend (str, optional): Backend reading the text layer, one of TEXT_BACKENDS, see get_text_backend. Defaults to TEXT_BACKEND.
+
+    Yields:
+        str: Extracted text of the page
+    """
+    text_backend = resolve_text_backend(text_backend)
+    if processes > 1:
+        if pages is None:
+            with closing(get_text_backend(file_path, text_backend)) as pdf:
+                pages = list(range(len(pdf)))
+        tasks = [(str(file_path), text_backend, page_indices) for page_indices in page_ranges(pages, processes)]
+        with Pool(processes=processes) as p:
+            for texts in p.imap(_extract_page_range, tasks):
+                yield from texts
+        return
+
+    with closing(get_text_backend(file_path, text_backend)) as pdf:
+        for page_index in range(len(pdf)) if pages is None else pages:
+            yield pdf.page_text(page_index)
+
+
+def iter_rendered_pages(file_path, window=RENDER_WINDOW, output_folder=None, pages=None, dpi=None, grayscale=False) -> Iterator:
+    """ Rasterizes a pdf a few pages at a time
+
+    Args:
+        file_path (PosixPath, str): Absolute path to the pdf file
+        window (int, optional): Pages rendered per pdf2image call. Defaults to RENDER_WINDOW.
+        output_folder (PosixPath, str, optional): If given, pages are rendered to files in this folder and their paths
+            are yielded instead of in-memory images. Defaults to None.
+        pages (list, optional): Sorted 0-based indices of the pages to render, None for all. Defaults to None.
+        dpi (int, optional): Render resolution, imaging.OCR_DEFAULT_DPI if None. Defaults to None.
+        grayscale (bool, optional): Render without colour, a third of the size. Defaults to False.
+
+    Yields:
+        PIL.Image.Image or str: Rendered page, or the path to it when output_folder is set
+    """
+    dpi = dpi or imaging.OCR_DEFAULT_DPI
+    if pages is None:
+        page_numbers = range(1, pdf2image.pdfinfo_from_path(file_path)['Pages'] + 1)
+    else:
+        page_numbers = [page_index + 1 for page_index in pages]
+    for first_page, last_page in _page_runs(page_numbers, window):
+        yield from pdf2image.convert_from_path(file_path, first_page=first_page, last_page=last_page, fmt='png', dpi=dpi, grayscale=grayscale,
+                                               output_folder=output_folder, paths_only=output_folder is not None)
+
+
+def iter_pages_ocr(file_path, window=RENDER_WINDOW, to_disk=False, pages=None, ocr_options=None, ocr_pool=None) -> Iterator[str]:
+    """ Yields the tesseract OCR text of each page of a pdf
+
+    Pages are rendered in windows by a background thread and fed to the OCR pool through a bounded queue, so
+    rasterization overlaps with OCR and only a few windows of images exist at any time. Workers keep their tesseract
+    engine loaded and OCR up to OCR_BATCH pages per task (see ocr_batch_size), texts are yielded in page order as soon
+    as they are ready. In memory pages reach the workers through handoff.ImageHandoff, memory-mapped files they read in
+    place, rather than being pickled through the pool's pipes.
+
+    Args:
+        file_path (PosixPath, str): Absolute path to the pdf file
+        window (int, optional): Pages rendered per pdf2image call. Defaults to RENDER_WINDOW.
+        to_disk (bool, optional): Render pages to png files in a temporary directory and hand workers the file
+            paths instead of shared raw images. Defaults to False.
+        pages (list, optional): Sorted 0-based indices of the pages to OCR, None for all. Defaults to None.
+        ocr_options (dict, optional): Engine, render DPI and preprocessing, overrides of OCR_OPTIONS. Defaults to None.
+        ocr_pool (workers.WorkerPool, optional): Pool to OCR with, e.g. one shared by the documents of a batch.
+            A pool sized to the available CPUs is used for this document when None. Defaults to None.
+
+    Yields:
+        str: OCR'd text of the page
+    """
+    engine, dpi, preprocess = ocr_settings(file_path, ocr_options)
+    if pages is None:
+        pages = list(range(pdf2image.pdfinfo_from_path(file_path)['Pages']))
+    stop = threading.Event()
+    handed = deque()  # shared images of the batches in the pool, released in order as their text comes back
+
+    def feed(pages, shared, in_flight, batch_size):
+        # runs in the pool's task handler thread, which would otherwise drain every rendered page at once
+        with closing(utils.prefetch(pages, maxsize=window * RENDER_AHEAD)) as rendered:
+            for batch in utils.batched(rendered, batch_size):
+                while not in_flight.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if shared is not None:
+                    batch = [shared.share(image) for image in batch]
+                    handed.append(batch)
+                yield batch
+
+    with tempfile.TemporaryDirectory(prefix='ironoxide_') if to_disk else nullcontext() as output_folder, \
+            nullcontext() if to_disk else handoff.ImageHandoff() as shared, \
+            nullcontext(ocr_pool) if ocr_pool is not None else workers.WorkerPool() as pool:
+        rendered = iter_rendered_pages(file_path, window=window, output_folder=output_folder, pages=pages, dpi=dpi, grayscale=preprocess['grayscale'])
+        in_flight = threading.BoundedSemaphore(pool.processes * OCR_AHEAD)  # batches handed to the pool but not yet yielded
+        try:
+            tasks = feed(rendered, shared, in_flight, ocr_batch_size(len(pages), pool.processes))
+            for texts in pool.imap(partial(_ocr_batch, engine=engine, remove=to_disk, **preprocess), tasks):
+                in_flight.release()
+                if shared is not None:
+                    for image in handed.popleft():
+                        shared.release(image)
+                yield from texts
+        finally:
+            stop.set()
+        if shared is not None:
+            logger.debug(f'Shared {shared.shared_count} pages ({shared.shared_bytes / 2**20:.1f} MiB) with the OCR workers')
+
+
+def page_needs_ocr(page) -> bool:
+    """ Decides whether a pdfplumber page has to be OCR'd because it has no usable text layer
+
+    Args:
+        page (pdfplumber.page.Page): Page to check
+
+    Returns:
+        bool: True if the page has almost no text, or is mostly image with only a thin text layer
+    """
+    char_count = len(page.chars)
+    if char_count < AUTO_MIN_CHARS:
+        return True
+    if char_count >= AUTO_SCAN_MAX_CHARS or not page.images:
+        return False
+
+    page_area = float(page.width * page.height) or 1.0
+    image_area = 0.0
+    for image in page.images:
+        width = min(image['x1'], page.bbox[2]) - max(image['x0'], page.bbox[0])
+        height = min(image['bottom'], page.bbox[3]) - max(image['top'], page.bbox[1])
+        image_area += max(width, 0) * max(height, 0)
+    return image_area / page_area >= AUTO_IMAGE_COVERAGE
+
 
-    start = time.perf_counter()
-    if ocr:
-        # Convert pdf to images to be OCR'd by tesseract
-        pages = convert_from_path(file_path)
-        logger.debug(f'Converted to images in {time.perf_counter() - start:.3f}s')
+def iter_pages_auto(file_path, pages=None, ocr_options=None, ocr_pool=None, text_backend=TEXT_BACKEND) -> Iterator[str]:
+    """ Yields the text of each page of a pdf, OCR'ing only the pages without a usable text layer
+
+    Pages are checked with page_needs_ocr. Pages that need it are rasterized one by one and OCR'd asynchronously
+    while the following pages are read, the OCR pool is only started once the first such page is found. Rendered
+    pages reach the workers through handoff.ImageHandoff, as in iter_pages_ocr.
+
+    Args:
+        file_path (PosixPath, str): Absolute path to the pdf file
+        pages (list, optional): Sorted 0-based indices of the pages to extract, None for all. Defaults to None.
+        ocr_options (dict, optional): Engine, render DPI and preprocessing, overrides of OCR_OPTIONS. Defaults to None.
+        ocr_pool (workers.WorkerPool, optional): Pool to OCR with, see iter_pages_ocr. Defaults to None.
+        text_backend (str, optional): Backend reading the text layer of the pages that aren't OCR'd, see get_text_backend.
+            pdfplumber still decides which pages need OCR. Defaults to TEXT_BACKEND.
+
+    Yields:
+        str: Text of the page, from the text layer or from tesseract
+    """
+    text_backend = resolve_text_backend(text_backend)
+    engine, dpi, preprocess = ocr_settings(file_path, ocr_options)
+    wanted = None if pages is None else set(pages)
+    pending = deque()  # page texts, or (AsyncResult, SharedImage) of pages being OCR'd, in page order
+    ocr_count = 0
+
+    def text_of(item) -> str:
+        if isinstance(item, str):
+            return item
+        result, image = item
+        text, = result.get()
+        shared.release(image)
+        return text
+
+    with ExitStack() as stack:
+        pool = stack.enter_context(nullcontext(ocr_pool) if ocr_pool is not None else workers.WorkerPool())  # starts with the first OCR task
+        shared = None
+        pdf = stack.enter_context(pdfplumber.open(file_path))
+        # pdfplumber's own pages give the text when it is the backend, it has parsed them already
+        text_pdf = stack.enter_context(closing(get_text_backend(file_path, text_backend))) if text_backend != 'pdfplumber' else None
+        for page_number, page in enumerate(pdf.pages, start=1):
+            if wanted is not None and page_number - 1 not in wanted:
+                continue
+            if page_needs_ocr(page):
+                if shared is None:
+                    shared = stack.enter_context(handoff.ImageHandoff())
+                image, = pdf2image.convert_from_path(file_path, first_page=page_number, last_page=page_number, dpi=dpi, grayscale=preprocess['grayscale'])
+                image = shared.share(image)
+                pending.append((pool.apply_async(_ocr_batch, ([image],), {'engine': engine, **preprocess}), image))
+                ocr_count += 1
+            elif text_pdf is not None:
+                pending.append(text_pdf.page_text(page_number - 1))
+            else:
+                pending.append(page.extract_text() or '')
+            page.close()
+
+            while pending and (isinstance(pending[0], str) or len(pending) > pool.processes * OCR_AHEAD):
+                yield text_of(pending.popleft())
+
+        while pending:
+            yield text_of(pending.popleft())
+        logger.debug(f'OCR\'d {ocr_count} of {len(pdf.pages) if wanted is None else len(wanted)} pages')
+
+
+def iter_pages(file_path, mode='text', processes=1, pages=None, ocr_options=None, ocr_pool=None, text_backend=TEXT_BACKEND) -> Iterator[str]:
+    """ Yields the text of each page of a pdf with the given extraction mode
+
+    Args:
+        file_path (PosixPath, str): Absolute path to the pdf file
+        mode (str, optional): 'text' for the pdfminer text layer, 'ocr' for tesseract on every page, 'auto' for
+            tesseract only on pages without a text layer. Defaults to 'text'.
+        processes (int, optional): Worker processes for 'text' mode, see iter_pages_text. Defaults to 1.
+        pages (list, optional): Sorted 0-based indices of the pages to extract, None for all. Defaults to None.
+        ocr_options (dict, optional): Engine, render DPI and preprocessing for 'ocr' and 'auto', overrides of OCR_OPTIONS. Defaults to None.
+        ocr_pool (workers.WorkerPool, optional): Pool to OCR with in 'ocr' and 'auto', see iter_pages_ocr. Defaults to None.
+        text_backend (str, optional): Text layer backend for 'text' and 'auto', see get_text_backend. Defaults to TEXT_BACKEND.
+
+    Yields:
+        str: Text of the page
+    """
+    if mode == 'text':
+        return iter_pages_text(file_path, processes=processes, pages=pages, text_backend=text_backend)
+    if mode == 'ocr':
+        return iter_pages_ocr(file_path, pages=pages, ocr_options=ocr_options, ocr_pool=ocr_pool)
+    if mode == 'auto':
+        return iter_pages_auto(file_path, pages=pages, ocr_options=ocr_options, ocr_pool=ocr_pool, text_backend=text_backend)
+    raise ValueError(f'Unknown conversion mode {mode!r}, expected one of {MODES}')
 
-        # OCR using tesseract with multithreading
-        p = Pool(processes=OCR_PROCESSES)
-        pages_text = p.map(ocr, pages)
-        fulltext = '\n'.join(pages_text)
-        logger.debug()(f'OCR\'d in {time.perf_counter() - start:.3f}s')
 
+def _object_digest(obj, memo: dict) -> bytes:
+    """ Digest of a pdf object and of everything it references, streams included
+
+    memo maps the ids of the indirect objects already hashed to their digests, so objects shared by many pages (fonts,
+    forms) are hashed once per document, and a reference back to an object being hashed ends the recursion.
+    """
+    if isinstance(obj, pdftypes.PDFObjRef):
+        if obj.objid not in memo:
+            memo[obj.objid] = f'ref {obj.objid}'.encode()  # stands in for the object on a cycle back to it
+            memo[obj.objid] = _object_digest(obj.resolve(), memo)
+        return memo[obj.objid]
+    digest = hashlib.sha256()
+    if isinstance(obj, pdftypes.PDFStream):
+        data = obj.get_rawdata()
+        digest.update(b'stream' + _object_digest(obj.attrs, memo) + (data if data is not None else obj.get_data()))
+    elif isinstance(obj, dict):
+        digest.update(b'dict')
+        for key in sorted(obj):
+            if key != 'Parent':  # back up the page tree, not part of what is drawn
+                digest.update(f'/{key}'.encode() + _object_digest(obj[key], memo))
+    elif isinstance(obj, (list, tuple)):
+        digest.update(b'list')
+        for item in obj:
+            digest.update(_object_digest(item, memo))
     else:
-        fulltext = ''
+        digest.update(repr(obj).encode())
+    return digest.digest()
+
+
+def page_hash(page, memo: dict = None) -> str:
+    """ Hashes what is drawn on a pdfplumber page: its box, content streams and everything its resources reference
+
+    Resources are followed recursively, so forms wrapping an image (e.g. a scan page whose content is just '/Im0 Do'),
+    nested forms, and fonts with their encodings, ToUnicode maps and embedded font files all count.
+
+    Args:
+        page (pdfplumber.page.Page): Page to hash
+        memo (dict, optional): Digests of the objects hashed for earlier pages of the same pdf, see _object_digest.
+            Defaults to None.
+
+    Returns:
+        str: sha256 hex digest, equal for identical pages across editions of a document
+    """
+    memo = {} if memo is None else memo
+    digest = hashlib.sha256(repr(page.bbox).encode())
+    for stream in page.page_obj.contents:
+        stream = pdftypes.resolve1(stream)
+        if isinstance(stream, pdftypes.PDFStream):
+            digest.update(stream.get_data())
+    digest.update(_object_digest(page.page_obj.resources or {}, memo))
+    return digest.hexdigest()
+
+
+def page_key_params(mode: str, text_backend: str, ocr_options: dict = None) -> dict:
+    """ What a page's text depends on besides its content: the extraction arguments and tuning constants in effect
+
+    Part of the page cache keys, and of the document keys through output_key_params, so changing any of them
+    re-extracts instead of returning text extracted with the old values.
+    """
+    params = {'mode': mode}
+    if mode != 'ocr':
+        params['text_backend'] = text_backend
+        if text_backend == 'pdfminer':
+            params['pdfminer_laparams'] = PDFMINER_LAPARAMS
+    if mode == 'auto':
+        params['auto_tuning'] = [AUTO_MIN_CHARS, AUTO_IMAGE_COVERAGE, AUTO_SCAN_MAX_CHARS]
+    if mode != 'text':
+        params['ocr_options'] = {**OCR_OPTIONS, **(ocr_options or {})}
+    return params
+
+
+def output_key_params(strip_boilerplate: bool, dedup: bool, pack_budget: int) -> dict:
+    """ Tuning constants of the steps after extraction that change a conversion's records, part of the document keys """
+    params = {'min_words': segment.MIN_WORDS, 'max_chars': segment.MAX_CHARS, 'sentence_end': segment.SENTENCE_END.pattern}
+    if strip_boilerplate:
+        params['boilerplate_tuning'] = [BOILERPLATE_EDGE_LINES, BOILERPLATE_WINDOW, BOILERPLATE_MIN_FRACTION, BOILERPLATE_MIN_PAGES]
+    if dedup:
+        params['dedup_tuning'] = [DEDUP_SHINGLE, DEDUP_BANDS, DEDUP_ROWS, DEDUP_THRESHOLD, DEDUP_SEED, DEDUP_SIGNATURE_VERSION]
+    if pack_budget:
+        params['pack_separator'] = segment.PACK_SEPARATOR
+    return params
+
+
+def iter_pages_cached(file_path, conversion_cache: cache.ConversionCache, mode='text', processes=1, ocr_options=None, ocr_pool=None,
+                      text_backend=TEXT_BACKEND, run_metrics: metrics.Metrics = None) -> Iterator[str]:
+    """ Yields the text of each page of a pdf, extracting only the pages not found in the conversion cache
+
+    Pages are matched by page_hash, so a new edition of a document only re-extracts the pages that changed.
+
+    Args:
+        file_path (PosixPath, str): Absolute path to the pdf file
+        conversion_cache (cache.ConversionCache): Cache to read page texts from and store new ones in
+        mode (str, optional): Extraction mode, see iter_pages. Defaults to 'text'.
+        processes (int, optional): Worker processes for 'text' mode, see iter_pages_text. Defaults to 1.
+        ocr_options (dict, optional): Engine, render DPI and preprocessing for 'ocr' and 'auto', see iter_pages. Defaults to None.
+        ocr_pool (workers.WorkerPool, optional): Pool to OCR with, see iter_pages. Defaults to None.
+        text_backend (str, optional): Text layer backend for 'text' and 'auto', part of the page keys, see get_text_backend. Defaults to TEXT_BACKEND.
+        run_metrics (metrics.Metrics, optional): Records the 'page_cache' stage and the page cache hits and misses. Defaults to None.
+
+    Yields:
+        str: Text of the page
+    """
+    text_backend = resolve_text_backend(text_backend)
+    params = page_key_params(mode, text_backend, ocr_options)
+    with run_metrics.stage('page_cache') if run_metrics is not None else nullcontext():
         with pdfplumber.open(file_path) as pdf:
+            keys = []
+            memo = {}
             for page in pdf.pages:
-                fulltext += page.extract_text() + '\n'
-
-        # format and filter output and write to file
-        # sentences = fulltext.split('.')
-        sentences = fulltext.split('.\n') # this works best so far
-        output = []
-        for sentence in sentences:
-            if len(sentence.replace('.', '').split(' ')) > MIN_WORDS:
-                output.append({'text': utils.clean_str(sentence[:MAX_CHARS])})
-        # logger.debug(f'Got PDF text in {time.perf_counter() - start:.3f}s')
-
-    output_path = settings.DATA_PATH/'output.jsonl'
-    with open(output_path, 'w') as f:
-        for line in output:
-            f.write(json.dumps(line) + '\n')
-    logger.debug(f'Saved output in {time.perf_counter() - start:.3f}s')
-    return output_path
+                keys.append(cache.make_key(page_hash(page, memo), **params))
+                page.close()
+        cached = conversion_cache.get_pages(keys)
+    missing = [page_index for page_index, key in enumerate(keys) if key not in cached]
+    logger.debug(f'{len(keys) - len(missing)} of {len(keys)} pages cached')
+    if run_metrics is not None:
+        run_metrics.count('page_cache_hits', len(keys) - len(missing))
+        run_metrics.count('page_cache_misses', len(missing))
+
+    extracted = iter_pages(file_path, mode=mode, processes=processes, pages=missing, ocr_options=ocr_options, ocr_pool=ocr_pool,
+                           text_backend=text_backend) if missing else iter(())
+    for key in keys:
+        if key in cached:
+            yield cached[key]
+        else:
+            text = next(extracted)
+            conversion_cache.put_page(key, text)
+            yield text
+
+
+_DIGITS = re.compile(r'\d+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _boilerplate_key(line: str) -> str:
+    """ Normalizes a header or footer line so page numbers and spacing don't make recurring lines look different """
+    return _DIGITS.sub('#', _WHITESPACE.sub(' ', line.strip()))
+
+
+class BoilerplateStripper:
+    """ Drops running headers, footers and page numbers from a stream of page texts
+
+    Candidates are the first and last BOILERPLATE_EDGE_LINES non-empty lines of each page. A candidate is dropped when
+    its normalized text (digits collapsed, see _boilerplate_key) is also a candidate on enough of the pages in a window
+    around it. Only half a window of pages is held back, so memory stays bounded on any document length and running
+    headers that change per chapter are caught too.
+
+    Attributes:
+        removed_lines (int): Number of lines dropped so far
+        removed_bytes (int): utf-8 bytes (newlines included) dropped so far
+    """
+
+    def __init__(self, window=BOILERPLATE_WINDOW, edge_lines=BOILERPLATE_EDGE_LINES, min_fraction=BOILERPLATE_MIN_FRACTION, min_pages=BOILERPLATE_MIN_PAGES):
+        self.window = window
+        self.edge_lines = edge_lines
+        self.min_fraction = min_fraction
+        self.min_pages = min_pages
+        self.removed_lines = 0
+        self.removed_bytes = 0
+
+    def _candidates(self, lines: list) -> dict:
+        # {line index: key} of the non-empty lines at the edges of the page
+        filled = [i for i, line in enumerate(lines) if line.strip()]
+        edges = filled if len(filled) <= 2 * self.edge_lines else filled[:self.edge_lines] + filled[-self.edge_lines:]
+        return {i: _boilerplate_key(lines[i]) for i in edges}
+
+    def __call__(self, pages: Iterable[str]) -> Iterator[str]:
+        """ Yields each page text with its recurring header and footer lines removed """
+        lookahead = self.window // 2
+        counts = Counter()  # pages in the window each candidate key appears on
+        ahead = deque()  # (lines, candidates) of pages read but not yielded yet
+        behind = deque()  # candidate keys of the pages yielded last, still in the window
+
+        def emit():
+            lines, candidates = ahead.popleft()
+            threshold = max(self.min_pages, self.min_fraction * (len(behind) + 1 + len(ahead)))
+            drop = {i for i, key in candidates.items() if counts[key] >= threshold}
+            for i in drop:
+                self.removed_bytes += len(lines[i].encode()) + 1
+            self.removed_lines += len(drop)
+
+            behind.append(set(candidates.values()))
+            if len(behind) > self.window - lookahead - 1:
+                counts.subtract(behind.popleft())
+            return '\n'.join(line for i, line in enumerate(lines) if i not in drop)
+
+        for text in pages:
+            lines = text.split('\n')
+            candidates = self._candidates(lines)
+            counts.update(set(candidates.values()))
+            ahead.append((lines, candidates))
+            if len(ahead) > lookahead:
+                yield emit()
+        while ahead:
+            yield emit()
+
+
+def _observe_pages(pages: Iterable[str], progress=None, run_metrics: metrics.Metrics = None) -> Iterator[str]:
+    for page_count, text in enumerate(pages, start=1):
+        if run_metrics is not None:
+            run_metrics.count('pages')
+        yield text
+        if progress is not None:
+            progress(page_count)
+
+
+def iter_chunks(file_path, ocr=False, processes=1, mode='text', conversion_cache=None, strip_boilerplate=True, dedup_index=None, source=None,
+                pack_budget=PACK_BUDGET, pack_overlap=0, pack_unit='chars', ocr_options=None, ocr_pool=None, text_backend=TEXT_BACKEND, progress=None,
+                run_metrics: metrics.Metrics = None) -> Iterator[dict]:
+    """ Yields the cleaned jsonl records of a pdf page by page
+
+    Args:
+        file_path (PosixPath, str): Absolute path to the pdf file
+        ocr (bool, optional): If the OCR method should be used to extract text instead of the pdfminer method, same as mode='ocr'. Defaults to False.
+        processes (int, optional): Worker processes for pdfminer extraction, see iter_pages_text. Defaults to 1.
+        mode (str, optional): Extraction mode, one of MODES, see iter_pages. Defaults to 'text'.
+        conversion_cache (cache.ConversionCache, optional): Reuse page texts cached from earlier conversions, see iter_pages_cached. Defaults to None.
+        strip_boilerplate (bool, optional): Drop running headers, footers and page numbers before segmentation, see BoilerplateStripper. Defaults to True.
+        dedup_index (dedup.DedupIndex, optional): Drop chunks that duplicate, exactly or nearly, one already in the index. Defaults to None.
+        source (str, optional): Identifies the pdf in dedup_index, e.g. its hash. Defaults to None.
+        pack_budget (int, optional): Pack consecutive sentences into chunks of up to this many pack_units, see segment.pack.
+            0 or None for one record per sentence, cut to segment.MAX_CHARS. Defaults to PACK_BUDGET.
+        pack_overlap (int, optional): pack_units of the previous chunk's last sentences repeated at the start of the next. Defaults to 0.
+        pack_unit (str, optional): 'chars' or 'tokens'. Defaults to 'chars'.
+        ocr_options (dict, optional): Engine, render DPI and preprocessing for 'ocr' and 'auto', overrides of OCR_OPTIONS. Defaults to None.
+        ocr_pool (workers.WorkerPool, optional): Pool to OCR with in 'ocr' and 'auto', see iter_pages_ocr. Defaults to None.
+        text_backend (str, optional): Text layer backend for 'text' and 'auto', see get_text_backend. Defaults to TEXT_BACKEND.
+        progress (Callable[[int], None], optional): Called with the number of pages extracted so far after each page. Defaults to None.
+        run_metrics (metrics.Metrics, optional): Records the time of each stage (extract, boilerplate, segment, dedup,
+            pack) and counts pages, chunks and what was stripped or dropped. Defaults to None.
+
+    Yields:
+        dict: Record with the chunk under 'text' and the 1-based page it starts on under 'page'
+    """
+    def timed(stage, iterable):
+        return run_metrics.timed(stage, iterable) if run_metrics is not None else iterable
+
+    mode = 'ocr' if ocr else mode
+    if conversion_cache is not None:
+        pages = iter_pages_cached(file_path, conversion_cache, mode=mode, processes=processes, ocr_options=ocr_options, ocr_pool=ocr_pool,
+                                  text_backend=text_backend, run_metrics=run_metrics)
+    else:
+        pages = iter_pages(file_path, mode=mode, processes=processes, ocr_options=ocr_options, ocr_pool=ocr_pool, text_backend=text_backend)
+    pages = timed('extract', pages)
+    if progress is not None or run_metrics is not None:
+        pages = _observe_pages(pages, progress=progress, run_metrics=run_metrics)
+    if strip_boilerplate:
+        stripper = BoilerplateStripper()
+        pages = timed('boilerplate', stripper(pages))
+    sentences = timed('segment', segment.iter_segments(pages, min_words=segment.MIN_WORDS, max_chars=None if pack_budget else segment.MAX_CHARS, with_pages=True))
+    if dedup_index is not None:
+        sentences = timed('dedup', (item for item in sentences if dedup_index.add(item[1], source)))
+    if pack_budget:
+        sentences = timed('pack', segment.pack(sentences, budget=pack_budget, overlap=pack_overlap, unit=pack_unit, with_pages=True))
+    for page, chunk in sentences:
+        yield {'text': chunk, 'page': page}
+    if strip_boilerplate:
+        logger.info(f'Stripped {stripper.removed_lines} header/footer lines ({stripper.removed_bytes} bytes)')
+    if dedup_index is not None:
+        logger.info(f'Dropped {dedup_index.dropped_exact} duplicate and {dedup_index.dropped_near} near-duplicate chunks')
+    if run_metrics is not None:
+        if strip_boilerplate:
+            run_metrics.count('boilerplate_lines_removed', stripper.removed_lines)
+            run_metrics.count('boilerplate_bytes_removed', stripper.removed_bytes)
+        if dedup_index is not None:
+            run_metrics.count('duplicates_dropped', dedup_index.dropped_exact)
+            run_metrics.count('near_duplicates_dropped', dedup_index.dropped_near)
+
+
+def convert(file_path, ocr=False, processes=1, mode='text', use_cache=True, output_path=None, output_format=None, strip_boilerplate=True, dedup=True, dedup_scope=None,
+            pack_budget=PACK_BUDGET, pack_overlap=0, pack_unit='chars', ocr_options=None, ocr_pool=None, progress=None, run_metrics=None,
+            index_course=None, search_path=None, profile=False, trace_memory=False, flamegraph=False, text_backend=TEXT_BACKEND) -> Path:
+    """ Converts a pdf to a jsonl file (or one of the other store.FORMATS)
+
+    Args:
+        file_path (PosixPath, str): Absolute path to the pdf file
+        ocr (bool, optional): If the OCR method should be used to extract text instead of the pdfminer method, same as mode='ocr'. Defaults to False.
+        processes (int, optional): Worker processes for pdfminer extraction, see iter_pages_text. Defaults to 1.
+        mode (str, optional): Extraction mode, one of MODES: 'text', 'ocr' or 'auto' (OCR only pages without a text layer). Defaults to 'text'.
+        use_cache (bool, optional): Return the cached output of an identical earlier conversion, and reuse cached pages
+            of earlier editions of the document. Defaults to True.
+        output_path (PosixPath, str, optional): Where to write the output, written to a temporary file and renamed into place
+            once complete. store.STDOUT ('-') streams the records to stdout as they are produced instead, skipping the
+            document cache (cached pages are still used). Defaults to a file in OUTPUT_PATH named after the pdf, see store.output_name.
+        output_format (str, optional): One of store.FORMATS: 'jsonl', 'gzip' or 'zstd' compressed jsonl, or a 'chunks' store.
+            Guessed from output_path when None, jsonl if that doesn't tell. Defaults to None.
+        strip_boilerplate (bool, optional): Drop running headers, footers and page numbers, see BoilerplateStripper. Defaults to True.
+        dedup (bool, optional): Drop exact and near-duplicate chunks, see dedup.DedupIndex. Defaults to True.
+        dedup_scope (str, optional): Also drop chunks duplicating earlier documents converted with the same scope (e.g. a course),
+            using the persistent index at dedup.DEDUP_PATH. Only within this document when None. Defaults to None.
+        pack_budget (int, optional): Pack sentences into chunks of up to this many pack_units instead of one record per
+            truncated sentence, see segment.pack. 0 or None to turn off. Defaults to PACK_BUDGET.
+        pack_overlap (int, optional): pack_units repeated from the end of each chunk at the start of the next. Defaults to 0.
+        pack_unit (str, optional): 'chars' or 'tokens', what pack_budget and pack_overlap count. Defaults to 'chars'.
+        ocr_options (dict, optional): Overrides of OCR_OPTIONS for the 'ocr' and 'auto' modes: tesseract 'engine',
+            render 'dpi' (or 'auto'), and the 'grayscale', 'binarize' and 'deskew' preprocessing steps. Defaults to None.
+        ocr_pool (workers.WorkerPool, optional): Pool to OCR with, so the documents of a batch share one set of warm
+            workers. A pool sized to the available CPUs is started for this document when needed if None. Defaults to None.
+        progress (Callable[[int], None], optional): Called with the number of pages extracted so far after each page. Defaults to None.
+        run_metrics (metrics.Metrics, optional): Records stage times, page counts, bytes in and out and cache hits of
+            the conversion, e.g. to write a report of. Its summary is logged at the end. Defaults to None.
+        index_course (str, optional): Also add the chunks, with the page each starts on, to the full-text search index
+            under this course, see search.SearchIndex. Defaults to None.
+        search_path (PosixPath, str, optional): Search index to add them to. Defaults to search.SEARCH_PATH.
+        profile (bool, optional): cProfile each stage, writing the top functions and the stats next to the output,
+            see profiling.RunProfiler. Defaults to False.
+        trace_memory (bool, optional): Trace allocations, writing each stage's peak and the allocation sites at the
+            run's peak next to the output. Defaults to False.
+        flamegraph (bool, optional): Sample stacks into a collapsed-stack file next to the output. Defaults to False.
+        text_backend (str, optional): What reads the text layer in the 'text' and 'auto' modes, one of TEXT_BACKENDS:
+            'pdfplumber', the faster 'pdfminer', the optional 'pypdfium2' and 'pymupdf', or 'fastest' of those installed.
+            Their texts differ a little, so they are cached separately, see get_text_backend. Defaults to TEXT_BACKEND.
+
+    Returns:
+        Path: Absolute path to the output file, None when streamed to stdout
+    """
+
+    logger.info(f'Converting {file_path} to jsonl')
+
+    run_metrics = run_metrics if run_metrics is not None else metrics.Metrics('convert')
+    mode = 'ocr' if ocr else mode
+    text_backend = resolve_text_backend(text_backend)
+    output_format = output_format or (store.format_for(output_path) if output_path else 'jsonl')
+    to_stdout = str(output_path) == store.STDOUT
+    if not to_stdout:
+        output_path = Path(output_path) if output_path else OUTPUT_PATH/store.output_name(Path(file_path).resolve(), output_format)
+    run_metrics.info.update({'source': str(file_path), 'mode': mode, 'text_backend': text_backend, 'output': str(output_path), 'output_format': output_format})
+    run_metrics.count('bytes_in', os.path.getsize(file_path))
+    with ExitStack() as stack:
+        if profile or trace_memory or flamegraph:
+            # next to the output, or to where it would have gone when streamed to stdout
+            base_path = OUTPUT_PATH/store.output_name(Path(file_path).resolve(), output_format) if to_stdout else output_path
+            stack.enter_context(profiling.RunProfiler(run_metrics, base_path, profile=profile, trace_memory=trace_memory, flamegraph=flamegraph))
+        with run_metrics.stage('hash'):
+            file_hash = cache.file_hash(file_path) if use_cache or dedup_scope or index_course else None
+        search_index = stack.enter_context(search.SearchIndex(search_path or search.SEARCH_PATH)) if index_course else None
+        # a cached output is only enough if its chunks are already indexed too
+        indexed = search_index is None or search_index.has(file_hash, index_course)
+        conversion_cache = stack.enter_context(cache.ConversionCache()) if use_cache else None
+        use_document_cache = conversion_cache is not None and not to_stdout
+        if use_document_cache:
+            key = cache.make_key(file_hash, output_format=output_format, strip_boilerplate=strip_boilerplate, dedup=dedup, dedup_scope=dedup_scope,
+                                 pack_budget=pack_budget, pack_overlap=pack_overlap, pack_unit=pack_unit,
+                                 **page_key_params(mode, text_backend, ocr_options), **output_key_params(strip_boilerplate, dedup, pack_budget))
+            with run_metrics.stage('document_cache'):
+                hit = indexed and conversion_cache.get_document(key, output_path)
+            run_metrics.count('document_cache_hits' if hit else 'document_cache_misses')
+            if hit:
+                run_metrics.count('bytes_out', output_path.stat().st_size)
+                logger.info(run_metrics.summary())
+                return output_path
+
+        if search_index is not None:
+            search_index.forget(file_hash, index_course)
+
+        dedup_index = None
+        if dedup:
+            dedup_index = stack.enter_context(DedupIndex(DEDUP_PATH if dedup_scope else None, scope=dedup_scope or ''))
+            if dedup_scope:
+                dedup_index.forget(file_hash)
+
+        # write's own time, the stages of iter_chunks are timed separately
+        with run_metrics.stage('write'), store.open_writer(output_path, output_format) as writer:
+            for chunk in iter_chunks(file_path, processes=processes, mode=mode, conversion_cache=conversion_cache, strip_boilerplate=strip_boilerplate,
+                                     dedup_index=dedup_index, source=file_hash, pack_budget=pack_budget, pack_overlap=pack_overlap, pack_unit=pack_unit,
+                                     ocr_options=ocr_options, ocr_pool=ocr_pool, text_backend=text_backend, progress=progress, run_metrics=run_metrics):
+                writer.write({'text': chunk['text']})
+                run_metrics.count('chunks')
+                if search_index is not None:
+                    with run_metrics.stage('index'):
+                        search_index.add(chunk['text'], file_hash, index_course, page=chunk['page'])
+        if not to_stdout:
+            run_metrics.count('bytes_out', output_path.stat().st_size)
+
+        if search_index is not None:
+            search_index.finish(file_hash, index_course, path=file_path)
+
+        if use_document_cache:
+            with run_metrics.stage('document_cache'):
+                conversion_cache.put_document(key, output_path)
+    logger.info(run_metrics.summary())
+    return None if to_stdout else output_path
 
 
 if __name__ == '__main__':
@@ -0,0 +1,138 @@
+""" exact and near-duplicate (MinHash LSH) chunk elimination, within a document and across a course's documents """
+import hashlib
+import logging
+import re
+import zlib
+from array import array
+from pathlib import Path
+
+from ironoxide import settings, sqlitedb
+
+logger = logging.getLogger(__file__)
+logger.setLevel(settings.LOGGING_LEVEL_MODULE)
+
+DEDUP_PATH = settings.DATA_PATH/'dedup.sqlite3'
+DEDUP_SHINGLE = 3  # words per shingle
+DEDUP_BANDS = 16  # LSH bands..
+DEDUP_ROWS = 4  # ..of this many minhashes each, chunks sharing a band are compared
+DEDUP_THRESHOLD = 0.8  # estimated jaccard similarity above which a chunk is a near-duplicate
+DEDUP_SEED = 1337  # fixed so signatures stay comparable across runs
+DEDUP_SIGNATURE_VERSION = 2  # bumped when signatures change, an index of older ones is cleared as they can't be compared
+DEDUP_COMMIT_EVERY = 64  # chunks added between commits, other documents of the scope converted meanwhile only match committed ones
+
+_SALT = DEDUP_SEED.to_bytes(8, 'little')
+_SIGNATURE_BYTES = DEDUP_BANDS * DEDUP_ROWS * array('I').itemsize
+_WORD = re.compile(r'\w+')
+
+
+def normalize(text: str) -> str:
+    """ Lowercased words joined by single spaces, so spacing and punctuation don't hide duplicates """
+    return ' '.join(_WORD.findall(text.lower()))
+
+
+def signature(text: str) -> array:
+    """ MinHash signature of the word shingles of text
+
+        Each shingle is hashed once with shake_128 into DEDUP_BANDS * DEDUP_ROWS independent 32 bit hashes, in C, instead
+        of one hash permuted that many times in Python. Each minhash is the column-wise min over the shingles.
+
+        Args:
+            text(str): normalized text, see normalize
+
+        Returns:
+            array: DEDUP_BANDS * DEDUP_ROWS unsigned 32 bit minhashes
+    """
+    words = text.split(' ')
+    shingles = {' '.join(words[i:i + DEDUP_SHINGLE]) for i in range(max(1, len(words) - DEDUP_SHINGLE + 1))}
+    rows = [array('I', hashlib.shake_128(_SALT + shingle.encode()).digest(_SIGNATURE_BYTES)) for shingle in shingles]
+    return array('I', map(min, zip(*rows)))
+
+
+def similarity(a: array, b: array) -> float:
+    """ Jaccard similarity estimated from two signatures """
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def _band_keys(sig: array) -> list:
+    # one integer per band: band number in the high bits, crc of its rows in the low 32
+    raw, step = sig.tobytes(), DEDUP_ROWS * sig.itemsize
+    return [(band << 32) | zlib.crc32(raw[band * step:(band + 1) * step]) for band in range(DEDUP_BANDS)]
+
+
+class DedupIndex:
+    """ Index of the chunks kept so far, used to drop exact and near-duplicate chunks
+
+        Chunks are stored per scope (e.g. a course) with the source they came from (e.g. the hash of the pdf), so a new
+        document is checked incrementally against everything kept before for the same scope. Without a path the index
+        lives in memory and only deduplicates within one run.
+
+        Attributes:
+            dropped_exact(int): chunks dropped as exact duplicates
+            dropped_near(int): chunks dropped as near-duplicates
+    """
+
+    def __init__(self, path: Path = None, scope: str = ''):
+        self.scope = scope
+        self.db = sqlitedb.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, scope TEXT NOT NULL, source TEXT, exact TEXT NOT NULL, signature BLOB NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS chunks_exact ON chunks (scope, exact)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS chunks_source ON chunks (scope, source)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS bands (scope TEXT NOT NULL, key INTEGER NOT NULL, chunk_id INTEGER NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS bands_key ON bands (scope, key)')
+        version, = self.db.execute('PRAGMA user_version').fetchone()
+        if version != DEDUP_SIGNATURE_VERSION:
+            if self.db.execute('SELECT 1 FROM chunks LIMIT 1').fetchone():
+                logger.warning(f'Clearing the dedup index at {path}, its signatures are from an older version')
+                self.db.execute('DELETE FROM bands')
+                self.db.execute('DELETE FROM chunks')
+            self.db.execute(f'PRAGMA user_version = {DEDUP_SIGNATURE_VERSION}')
+        self.db.commit()
+        self.dropped_exact = 0
+        self.dropped_near = 0
+        self._commits = sqlitedb.BatchedCommits(self.db, DEDUP_COMMIT_EVERY)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def forget(self, source: str):
+        """ Removes the chunks of source, so reconverting a document doesn't match against its own earlier chunks """
+        ids = [(chunk_id,) for chunk_id, in self.db.execute('SELECT id FROM chunks WHERE scope = ? AND source = ?', (self.scope, source))]
+        self.db.executemany('DELETE FROM bands WHERE chunk_id = ?', ids)
+        self.db.execute('DELETE FROM chunks WHERE scope = ? AND source = ?', (self.scope, source))
+        self.db.commit()
+
+    def add(self, text: str, source: str = None) -> bool:
+        """ Adds a chunk unless it duplicates one already in the index
+
+            Args:
+                text(str): chunk text
+                source(str): where the chunk comes from
+
+            Returns:
+                bool: True if the chunk is new and was added, False if it is a duplicate and should be dropped
+        """
+        normalized = normalize(text)
+        exact = hashlib.sha1(normalized.encode()).hexdigest()
+        if self.db.execute('SELECT 1 FROM chunks WHERE scope = ? AND exact = ? LIMIT 1', (self.scope, exact)).fetchone():
+            self.dropped_exact += 1
+            return False
+
+        sig = signature(normalized)
+        keys = _band_keys(sig)
+        candidates = self.db.execute(f'SELECT DISTINCT chunks.signature FROM bands JOIN chunks ON chunks.id = bands.chunk_id WHERE bands.scope = ? AND bands.key IN ({",".join("?" * len(keys))})', (self.scope, *keys))
+        for candidate, in candidates:
+            if similarity(sig, array('I', candidate)) >= DEDUP_THRESHOLD:
+                self.dropped_near += 1
+                return False
+
+        chunk_id = self.db.execute('INSERT INTO chunks (scope, source, exact, signature) VALUES (?, ?, ?, ?)', (self.scope, source, exact, sig.tobytes())).lastrowid
+        self.db.executemany('INSERT INTO bands (scope, key, chunk_id) VALUES (?, ?, ?)', [(self.scope, key, chunk_id) for key in keys])
+        self._commits.wrote()
+        return True
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -1,11 +1,7 @@
-import json
 import logging
-import time
 from pathlib import Path
 
-import requests
-
-from ironoxide import settings
+from ironoxide import metrics, settings, uploader
 
 HERE = Path(__file__).parent
 
@@ -13,13 +9,32 @@ logger = logging.getLogger(__file__)
 logger.setLevel(settings.LOGGING_LEVEL_MODULE)
 
 
-def upload(file_path):
-    headers = {'Authorization': f'Bearer {settings.OPENAI_API_KEY}'}
-    files = {'file': open(file_path, 'rb')}
-    r = requests.post('https://api.openai.com/v1/files', headers=headers, data={'purpose': 'answers'}, files=files)
-    e = r.json()
+def upload(file_path, run_metrics: metrics.Metrics = None):
+    """ Uploads a file to OpenAI
+
+        Args:
+            file_path(PosixPath, str): file to upload
+            run_metrics(metrics.Metrics): records the upload time, bytes sent, retries and failures, its summary is logged
+
+        Returns:
+            dict: the uploaded file object, see uploader.UploadClient.upload_file
+    """
+    run_metrics = run_metrics if run_metrics is not None else metrics.Metrics('upload')
+    try:
+        e = uploader.upload_file(file_path, purpose='answers', run_metrics=run_metrics)
+    finally:
+        logger.info(run_metrics.summary())
     print(e)
+    return e
 
 
 if __name__ == '__main__':
-    upload(settings.DATA_PATH/'output.jsonl')
+    # python -m ironoxide.filemanager FILE: uploads FILE, or the default convert output of FILE if it is a pdf
+    import sys
+
+    from ironoxide import convert, store
+
+    file_path = Path(sys.argv[1])
+    if file_path.suffix.lower() == '.pdf':
+        file_path = convert.OUTPUT_PATH/store.output_name(file_path.resolve())
+    upload(file_path)
@@ -0,0 +1,124 @@
+""" handing rendered page images to worker processes through memory-mapped files instead of pickling their pixels """
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from PIL import Image
+
+from ironoxide import settings
+
+logger = logging.getLogger(__file__)
+logger.setLevel(settings.LOGGING_LEVEL_MODULE)
+
+HANDOFF_PATH = '/dev/shm' if os.path.isdir('/dev/shm') else None  # RAM backed on linux, tempfile's default dir elsewhere
+HANDOFF_MAX_SHARE = 0.5  # images go to disk instead once they would take more than this share of HANDOFF_PATH's free space
+HANDOFF_NETPBM = {'L': (b'P5', 'pgm'), 'RGB': (b'P6', 'ppm')}  # modes shared as netpbm files, which tesseract reads as they are
+
+
+class SharedImage:
+    """ Picklable reference to a page image held in a memory-mapped file, a few dozen bytes to send instead of the pixels
+
+        L and RGB pages are netpbm (pgm, ppm) files: a short header and the raw pixels, so an OCR engine can be given
+        the path as it is, while workers that need the pixels map them past the header.
+
+        Attributes:
+            path(str): pixel file
+            mode(str): PIL image mode
+            size(tuple): (width, height)
+            offset(int): bytes of netpbm header before the pixels, 0 for headerless raw pixels of the other modes
+    """
+    __slots__ = ('path', 'mode', 'size', 'offset')
+
+    def __init__(self, path: str, mode: str, size: tuple, offset: int = 0):
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.offset = offset
+
+    @property
+    def netpbm(self) -> bool:
+        """ True if path is a netpbm file image readers (tesseract, PIL) open by themselves """
+        return self.mode in HANDOFF_NETPBM
+
+    @contextmanager
+    def open(self):
+        """ Maps the file and yields an image reading its pixels in place, closed when the block exits
+
+            L, RGBA and CMYK pages are read without a copy, RGB pages (3 bytes a pixel, 4 in PIL) are copied once
+            within the worker.
+        """
+        with open(self.path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        pixels = memoryview(buffer)[self.offset:]
+        image = Image.frombuffer(self.mode, self.size, pixels, 'raw', self.mode, 0, 1)
+        try:
+            yield image
+        finally:
+            image.close()
+            try:
+                pixels.release()
+                buffer.close()
+            except BufferError:  # still exported by an image derived from it, unmapped when that is collected
+                pass
+
+
+class ImageHandoff:
+    """ Temporary folder of page images shared with worker processes, removed with everything left in it on close
+
+        Attributes:
+            shared_count(int): images shared so far
+            shared_bytes(int): pixel bytes written for them
+    """
+
+    def __init__(self):
+        self.folder = tempfile.TemporaryDirectory(prefix='ironoxide_pages_', dir=HANDOFF_PATH)
+        self.disk_folder = None  # fallback when HANDOFF_PATH fills up, /dev/shm is only 64MB in docker by default
+        self.shared_count = 0
+        self.shared_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _folder_for(self, size: int) -> str:
+        if HANDOFF_PATH is None or size <= shutil.disk_usage(self.folder.name).free * HANDOFF_MAX_SHARE:
+            return self.folder.name
+        if self.disk_folder is None:
+            logger.debug(f'{HANDOFF_PATH} is almost full, sharing page images through {tempfile.gettempdir()}')
+            self.disk_folder = tempfile.TemporaryDirectory(prefix='ironoxide_pages_')
+        return self.disk_folder.name
+
+    def share(self, image: Image.Image) -> SharedImage:
+        """ Writes the pixels of image to a file workers can map, netpbm for L and RGB images
+
+            Args:
+                image(Image.Image): rendered page, can be dropped once shared
+
+            Returns:
+                SharedImage: reference to pass to a worker, release it once the worker is done
+        """
+        data = image.tobytes()
+        magic, suffix = HANDOFF_NETPBM.get(image.mode, (None, 'raw'))
+        header = b'%s\n%d %d\n255\n' % (magic, *image.size) if magic else b''
+        path = Path(self._folder_for(len(data)))/f'{self.shared_count}.{suffix}'
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.write(data)
+        self.shared_count += 1
+        self.shared_bytes += len(data)
+        return SharedImage(str(path), image.mode, image.size, offset=len(header))
+
+    def release(self, shared: SharedImage):
+        """ Deletes a shared image, workers that still have it mapped keep reading it until they unmap it """
+        os.remove(shared.path)
+
+    def close(self):
+        self.folder.cleanup()
+        if self.disk_folder is not None:
+            self.disk_folder.cleanup()
@@ -0,0 +1,150 @@
+""" page image preprocessing for OCR: grayscale, binarization, deskew and render DPI selection """
+import logging
+import statistics
+
+import pdfplumber
+from PIL import Image
+
+from ironoxide import settings
+
+logger = logging.getLogger(__file__)
+logger.setLevel(settings.LOGGING_LEVEL_MODULE)
+
+OCR_MIN_DPI = 150  # auto DPI never renders below this..
+OCR_MAX_DPI = 300  # ..or above this, tesseract gains nothing past ~300 on body text
+OCR_DEFAULT_DPI = 200  # auto DPI when the pdf has no page images to measure, same as pdf2image's default
+DESKEW_MAX_ANGLE = 5.0  # degrees searched either way
+DESKEW_STEP = 0.5
+DESKEW_WIDTH = 600  # skew is estimated on a copy scaled down to this width
+
+
+def to_grayscale(image: Image.Image) -> Image.Image:
+    return image if image.mode == 'L' else image.convert('L')
+
+
+def otsu_threshold(image: Image.Image) -> int:
+    """ Otsu's threshold of a grayscale image, from its histogram
+
+        Args:
+            image(Image.Image): 'L' mode image
+
+        Returns:
+            int: gray level separating ink from paper
+    """
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    sum_all = sum(level * count for level, count in enumerate(histogram))
+    sum_background = weight_background = 0
+    best_threshold, best_variance = 127, -1.0
+    for level, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += level * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = level, variance
+    return best_threshold
+
+
+def to_black_and_white(image: Image.Image, threshold: int = None) -> Image.Image:
+    """ Black and white version of a grayscale image, thresholded with Otsu's method unless a threshold is given """
+    threshold = otsu_threshold(image) if threshold is None else threshold
+    return image.point([0 if level <= threshold else 255 for level in range(256)], 'L')
+
+
+def skew_angle(image: Image.Image) -> float:
+    """ Estimates how many degrees the text lines of a grayscale page are rotated
+
+        Tries every angle in DESKEW_STEP steps up to DESKEW_MAX_ANGLE on a scaled down copy and keeps the one whose row
+        darkness profile varies the most, which is when text lines run horizontally.
+
+        Args:
+            image(Image.Image): 'L' mode image
+
+        Returns:
+            float: counter-clockwise angle to rotate the page by to straighten it
+    """
+    scale = DESKEW_WIDTH / image.width
+    small = image.resize((DESKEW_WIDTH, max(1, round(image.height * scale))), Image.BILINEAR) if scale < 1 else image
+    steps = int(DESKEW_MAX_ANGLE / DESKEW_STEP)
+    best_angle, best_score = 0.0, -1.0
+    for step in sorted(range(-steps, steps + 1), key=abs):  # smallest angles first, so ties (e.g. blank pages) keep the page as is
+        angle = step * DESKEW_STEP
+        rotated = small.rotate(angle, resample=Image.BILINEAR, fillcolor=255)
+        rows = list(rotated.resize((1, rotated.height), Image.BOX).getdata())  # mean level of each row
+        score = statistics.pvariance(rows)
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def straighten(image: Image.Image) -> Image.Image:
+    angle = skew_angle(image)
+    if angle == 0:
+        return image
+    return image.rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=255)
+
+
+def preprocess(image: Image.Image, grayscale=True, binarize=True, deskew=True) -> Image.Image:
+    """ Prepares a rendered page for tesseract
+
+        Args:
+            image(Image.Image): rendered page
+            grayscale(bool): drop colour
+            binarize(bool): threshold to black and white with Otsu's method, implies grayscale
+            deskew(bool): straighten rotated scans, implies grayscale
+
+        Returns:
+            Image.Image: preprocessed page
+    """
+    if grayscale or binarize or deskew:
+        image = to_grayscale(image)
+    if deskew:
+        image = straighten(image)
+    if binarize:
+        image = to_black_and_white(image)
+    return image
+
+
+def native_dpi(page) -> float:
+    """ Resolution of the largest image drawn on a pdfplumber page, None if the page has no images """
+    best = None
+    for image in page.images:
+        width_inches = (image['x1'] - image['x0']) / 72
+        if width_inches <= 0 or not image.get('srcsize'):
+            continue
+        if best is None or width_inches > best[0]:
+            best = (width_inches, image['srcsize'][0] / width_inches)
+    return None if best is None else best[1]
+
+
+def choose_dpi(file_path, sample_pages=5) -> int:
+    """ Picks a render DPI for OCR: the resolution of the scanned page images, clamped to [OCR_MIN_DPI, OCR_MAX_DPI]
+
+        Rendering above a scan's own resolution only makes bigger images for tesseract without adding detail.
+
+        Args:
+            file_path(PosixPath, str): pdf to measure
+            sample_pages(int): pages looked at
+
+        Returns:
+            int: DPI to render at
+    """
+    resolutions = []
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages[:sample_pages]:
+            dpi = native_dpi(page)
+            if dpi is not None:
+                resolutions.append(dpi)
+            page.close()
+    if not resolutions:
+        return OCR_DEFAULT_DPI
+    dpi = int(min(max(statistics.median(resolutions), OCR_MIN_DPI), OCR_MAX_DPI))
+    logger.debug(f'Chose {dpi} DPI from page images of {file_path}')
+    return dpi
@@ -0,0 +1,180 @@
+""" worker running queued textbook jobs (models.Job): claimed from the database with leases, a few at a time """
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ironoxide import settings, workers
+
+settings.setup_django()  # before the models, also in the spawned job processes
+from ironoxide.models import Job
+
+logger = logging.getLogger(__file__)
+logger.setLevel(settings.LOGGING_LEVEL_MODULE)
+
+JOB_CONCURRENCY = 2  # jobs run at once by a worker
+JOB_LEASE = 120  # seconds a claimed job stays with its worker without a renewal
+JOB_RENEW_EVERY = 30  # seconds between lease renewals of the running jobs
+JOB_MAX_ATTEMPTS = 3  # attempts before a job is failed for good
+JOB_POLL = 1  # seconds between checks for new jobs and finished ones
+
+
+def worker_id() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def claim(worker: str, lease: float = JOB_LEASE) -> Job:
+    """ Takes the oldest queued job, or a running one whose worker let its lease expire
+
+        The job is taken with a conditional update on the state and lease it was read with, so two workers racing for
+        the same job can't both get it, without needing row locks (which sqlite doesn't have).
+
+        Args:
+            worker(str): id of the claiming worker, see worker_id
+            lease(float): seconds until another worker may take the job over, unless renewed
+
+        Returns:
+            Job: the claimed job, None if there is nothing to do
+    """
+    now = timezone.now()
+    candidates = Job.objects.filter(Q(state=Job.QUEUED) | Q(state=Job.RUNNING, lease_until__lt=now)).order_by('created_at')
+    for job in candidates[:16]:
+        if job.attempts >= JOB_MAX_ATTEMPTS:
+            Job.objects.filter(id=job.id, state=job.state, lease_until=job.lease_until).update(
+                state=Job.FAILED, finished_at=now, error=job.error or f'Gave up after {job.attempts} attempts', lease_until=None)
+            continue
+        claimed = Job.objects.filter(id=job.id, state=job.state, lease_until=job.lease_until).update(
+            state=Job.RUNNING, worker=worker, lease_until=now + timedelta(seconds=lease), attempts=F('attempts') + 1, started_at=now)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def renew(jobs: list, worker: str, lease: float = JOB_LEASE):
+    """ Extends the leases of jobs still held by worker """
+    Job.objects.filter(id__in=[job.id for job in jobs], worker=worker, state=Job.RUNNING).update(lease_until=timezone.now() + timedelta(seconds=lease))
+
+
+def finish(job: Job, worker: str, result: str = None, error: str = None, seconds: float = None):
+    """ Records the outcome of a job, requeueing a failed one while it has attempts left """
+    if error is None:
+        state = Job.DONE
+    else:
+        state = Job.QUEUED if job.attempts < JOB_MAX_ATTEMPTS else Job.FAILED
+    # only if the job is still ours, a worker that lost its lease must not overwrite the new owner's state
+    updated = Job.objects.filter(id=job.id, worker=worker, state=Job.RUNNING).update(
+        state=state, result=result, error=error, seconds=seconds, lease_until=None, finished_at=timezone.now() if state != Job.QUEUED else None)
+    if not updated:
+        logger.warning(f'Job {job.id} was taken over by another worker, dropping its result')
+    elif error is None:
+        logger.info(f'Job {job.id} done in {seconds:.1f}s: {result}')
+    else:
+        logger.warning(f'Job {job.id} attempt {job.attempts} failed, {state}: {error}')
+
+
+def _run_job(job_id: int) -> tuple:
+    """ Runs a job in a job process, returns (uploaded file id, seconds) """
+    start = time.perf_counter()
+    job = Job.objects.select_related('course').get(id=job_id)
+    result = job.course.sync_textbook(job.file_path, ocr_pool=workers.job_pool(), **job.options)
+    return result, time.perf_counter() - start
+
+
+def _executor(concurrency: int, ocr_processes: int) -> ProcessPoolExecutor:
+    # spawned, a forked child would share the parent's sqlite connection
+    return ProcessPoolExecutor(max_workers=concurrency, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=workers.init_job_pool, initargs=(ocr_processes,))
+
+
+def work(concurrency: int = JOB_CONCURRENCY, until_empty: bool = False, ocr_processes: int = None, poll: float = JOB_POLL) -> dict:
+    """ Runs queued jobs, concurrency at a time, each in its own process, until interrupted
+
+        Args:
+            concurrency(int): jobs run at once
+            until_empty(bool): return once there are no jobs left to claim and none running
+            ocr_processes(int): OCR worker processes per running job, None to split workers.available_cpus() between them
+            poll(float): seconds between checks for new and finished jobs
+
+        Returns:
+            dict: counts of the jobs done, requeued and failed
+    """
+    worker = worker_id()
+    ocr_processes = ocr_processes or max(1, workers.available_cpus() // concurrency)
+    summary = {'done': 0, 'requeued': 0, 'failed': 0}
+    logger.info(f'Job worker {worker} running {concurrency} jobs at a time')
+    executor = _executor(concurrency, ocr_processes)
+    running = {}  # future: job
+    renewed = time.monotonic()
+    try:
+        while True:
+            while len(running) < concurrency:
+                job = claim(worker)
+                if job is None:
+                    break
+                logger.info(f'Running job {job.id} (attempt {job.attempts}): {job.file_path}')
+                running[executor.submit(_run_job, job.id)] = job
+            if not running:
+                if until_empty:
+                    break
+                time.sleep(poll)
+                continue
+
+            done, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                job = running.pop(future)
+                try:
+                    result, seconds = future.result()
+                except Exception as e:
+                    broken = broken or isinstance(e, BrokenProcessPool)
+                    finish(job, worker, error=repr(e), seconds=None)
+                    job.refresh_from_db()
+                    summary['requeued' if job.state == Job.QUEUED else 'failed'] += 1
+                else:
+                    finish(job, worker, result=result, seconds=seconds)
+                    summary['done'] += 1
+            if broken:
+                # a job process died, e.g. killed for memory, the pool can't take new jobs anymore
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = _executor(concurrency, ocr_processes)
+
+            if running and time.monotonic() - renewed >= JOB_RENEW_EVERY:
+                renew(list(running.values()), worker)
+                renewed = time.monotonic()
+    finally:
+        # jobs still running are left to their leases, another worker takes them over once they expire
+        executor.shutdown(wait=False, cancel_futures=True)
+    return summary
+
+
+def wait_for(job_ids: list = None, poll: float = JOB_POLL, report=None) -> list:
+    """ Waits until jobs are done or failed
+
+        Args:
+            job_ids(list): ids of the jobs to wait for, every unfinished job if None
+            poll(float): seconds between checks
+            report(Callable[[Job], None]): called with each job whenever its state changes
+
+        Returns:
+            list[Job]: the finished jobs
+    """
+    if job_ids is None:
+        job_ids = list(Job.objects.filter(state__in=[Job.QUEUED, Job.RUNNING]).values_list('id', flat=True))
+    states = {}
+    while True:
+        jobs = list(Job.objects.filter(id__in=job_ids).order_by('id'))
+        for job in jobs:
+            if report is not None and states.get(job.id) != (job.state, job.attempts):
+                report(job)
+            states[job.id] = (job.state, job.attempts)
+        if all(job.finished for job in jobs):
+            return jobs
+        time.sleep(poll)
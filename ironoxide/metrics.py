@@ -0,0 +1,135 @@
+""" per-stage timings and counters of a conversion or upload, written as a json report and a prometheus textfile """
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from ironoxide import settings
+
+logger = logging.getLogger(__file__)
+logger.setLevel(settings.LOGGING_LEVEL_MODULE)
+
+METRICS_PREFIX = 'ironoxide'  # prometheus metric name prefix
+_METRIC_NAME = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def _atomic_write(path: Path, text: str):
+    # write-then-rename, node_exporter's textfile collector may read the file at any moment
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
+
+
+class Metrics:
+    """ Stage durations and counters (pages, bytes in and out, cache hits...) of one run
+
+        Stage times are exclusive: time spent in a stage nested in another, e.g. a generator timed with timed() pulling
+        from another timed generator, is only counted for the inner one, so stage times add up to the run's time.
+
+        Args:
+            job(str): what is being run, e.g. 'convert' or 'upload', the job label of the prometheus metrics
+    """
+
+    def __init__(self, job: str = 'convert'):
+        self.job = job
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.stage_seconds = defaultdict(float)
+        self.stage_calls = Counter()
+        self.counters = Counter()
+        self.info = {}  # run details for the json report, e.g. the source file and mode
+        self._nested = []  # time spent in stages nested in each of the stages being timed
+        self.profiler = None  # profiling.RunProfiler told when stages start and end, while one is attached
+
+    @contextmanager
+    def stage(self, name: str):
+        """ Times the block as stage name """
+        if self.profiler is not None:
+            self.profiler.enter(name)
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.profiler is not None:
+                self.profiler.exit(name)
+            self.stage_seconds[name] += elapsed - self._nested.pop()
+            self.stage_calls[name] += 1
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def timed(self, name: str, iterable: Iterable) -> Iterator:
+        """ Yields the items of iterable, timing the work of producing each one as stage name """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def merge(self, report: dict):
+        """ Adds the stage times and counters of another run's report(), e.g. of each document of a batch """
+        for name, stage in report['stages'].items():
+            self.stage_seconds[name] += stage['seconds']
+            self.stage_calls[name] += stage['calls']
+        self.counters.update(report['counters'])
+
+    @property
+    def seconds(self) -> float:
+        return time.perf_counter() - self._start
+
+    def report(self) -> dict:
+        return {
+            'job': self.job,
+            'started': self.started,
+            'seconds': self.seconds,
+            'info': self.info,
+            'stages': {name: {'seconds': self.stage_seconds[name], 'calls': self.stage_calls[name]} for name in self.stage_seconds},
+            'counters': dict(self.counters),
+        }
+
+    def summary(self) -> str:
+        """ One line for the logs: total time, then each stage's time and the counters """
+        stages = ', '.join(f'{name} {seconds:.3f}s' for name, seconds in sorted(self.stage_seconds.items(), key=lambda x: -x[1]))
+        counters = ', '.join(f'{name} {value}' for name, value in sorted(self.counters.items()))
+        return f'{self.job} took {self.seconds:.3f}s ({stages}) {counters}'
+
+    def write_json(self, path: Path):
+        """ Writes report() to path as json """
+        _atomic_write(path, json.dumps(self.report(), indent=2, default=str))
+
+    def prometheus(self) -> str:
+        """ The metrics in the prometheus text exposition format, as gauges of this (last) run """
+        job = self.job.replace('\\', '\\\\').replace('"', '\\"')
+        lines = [
+            f'# HELP {METRICS_PREFIX}_last_run_timestamp_seconds Unix time the last run started',
+            f'# TYPE {METRICS_PREFIX}_last_run_timestamp_seconds gauge',
+            f'{METRICS_PREFIX}_last_run_timestamp_seconds{{job="{job}"}} {self.started:.3f}',
+            f'# HELP {METRICS_PREFIX}_last_run_seconds Duration of the last run',
+            f'# TYPE {METRICS_PREFIX}_last_run_seconds gauge',
+            f'{METRICS_PREFIX}_last_run_seconds{{job="{job}"}} {self.seconds:.6f}',
+            f'# HELP {METRICS_PREFIX}_last_run_stage_seconds Time spent in each stage of the last run',
+            f'# TYPE {METRICS_PREFIX}_last_run_stage_seconds gauge',
+        ]
+        lines += [f'{METRICS_PREFIX}_last_run_stage_seconds{{job="{job}",stage="{name}"}} {seconds:.6f}' for name, seconds in sorted(self.stage_seconds.items())]
+        for name, value in sorted(self.counters.items()):
+            metric = f'{METRICS_PREFIX}_last_run_{_METRIC_NAME.sub("_", name)}'
+            lines += [f'# TYPE {metric} gauge', f'{metric}{{job="{job}"}} {value}']
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: Path):
+        """ Writes prometheus() to path, for node_exporter's textfile collector (path should end in .prom) """
+        _atomic_write(path, self.prometheus())
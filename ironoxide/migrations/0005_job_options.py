@@ -0,0 +1,18 @@
+# Generated by Django 4.0.4 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ironoxide', '0004_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='options',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
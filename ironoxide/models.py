@@ -1,11 +1,11 @@
 import logging
 from pathlib import Path
 
-import openai
 from bs4 import BeautifulSoup
 from django.db import models
 
 import ironoxide.settings as settings
+from ironoxide import cache, uploader
 from ironoxide.convert import convert
 
 logger = logging.getLogger(__file__)
@@ -39,18 +39,113 @@ class Course(IU_PageElement):
         self.url = element['href'] if 'href' in element.attrs else None
         return self
         
-    def upload(self, file_path: Path = settings.DATA_PATH/'colab.pdf'):
-        output_path = convert(file_path)
-        response = openai.File.create(file=open(output_path), purpose='answers', user_provided_filename=f'{self.title}_textbook.jsonl')
+    def upload(self, file_path: Path = settings.DATA_PATH/'colab.pdf', options: dict = None) -> 'Job':
+        """ Queues the conversion and upload of the course's textbook, see sync_textbook, for a jobs worker to run """
+        return Job.enqueue(self, file_path, options)
+
+    def sync_textbook(self, file_path: Path, ocr_pool=None, **options) -> str:
+        """ Converts the textbook and uploads it, unless the same content was uploaded before, and saves its id
+
+            Args:
+                file_path(Path): the textbook pdf
+                ocr_pool(workers.WorkerPool): pool to OCR with, see convert
+                **options: passed on to convert (mode, text_backend, ocr_options, use_cache, pack_budget, ..), the output
+                    is always jsonl, deduplicated and indexed under the course
+
+            Returns:
+                str: the uploaded file's id
+        """
+        output_path = convert(file_path, output_path=settings.DATA_PATH/'textbooks'/f'course-{self.iu_id}.jsonl', dedup_scope=f'course-{self.iu_id}',
+                              index_course=str(self.iu_id), ocr_pool=ocr_pool, **options)
+        self.textbook_id = Upload.upload(output_path, purpose='answers', filename=f'{self.title}_textbook.jsonl').remote_id
+        self.save(update_fields=['textbook_id', 'updated_at'])
+        return self.textbook_id
+
+    def __repr__(self) -> str:
+        return f'<{self.__class__.__name__}: {self.title}>'
+
+
+class Upload(models.Model):
+    """ A file uploaded to OpenAI, by the sha256 of its content, so identical content is only ever uploaded once """
+    content_hash = models.CharField(max_length=64)
+    purpose = models.CharField(max_length=32)
+    remote_id = models.CharField(max_length=64)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    live = models.BooleanField(default=True)  # False once the files endpoint answered 404 for remote_id, see upload
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['content_hash', 'purpose'], name='unique_upload_content')]
+
+    @classmethod
+    def upload(cls, file_path: Path, purpose: str = 'answers', filename: str = None) -> 'Upload':
+        """ Uploads a file unless a live upload of the same content and purpose is recorded, then returns that one
+
+            The recorded upload is checked with the files endpoint first, if its remote file was deleted it is marked
+            as no longer live and the file is uploaded again.
+
+            Args:
+                file_path(Path): file to upload
+                purpose(str): what the file is for
+                filename(str): name to give the uploaded file, file_path's name if None
+
+            Returns:
+                Upload: the record, with the file's remote_id
+        """
+        content_hash = cache.file_hash(file_path)
+        existing = cls.objects.filter(content_hash=content_hash, purpose=purpose, live=True).first()
+        if existing is not None:
+            if uploader.file_exists(existing.remote_id):
+                logger.info(f'{file_path} was already uploaded as {existing.remote_id}, skipping the upload')
+                return existing
+            logger.info(f'{existing.remote_id} of {file_path} was deleted remotely, uploading it again')
+            existing.live = False
+            existing.save(update_fields=['live', 'updated_at'])
+
+        response = uploader.upload_file(file_path, purpose=purpose, filename=filename)
         logger.debug(response)
-        if response['status'] == 'uploaded':
-            self.textbook_id = response['id']
-        else:
+        if response.get('status') != 'uploaded':
             raise ValueError(f'OpenAI upload failed: {response}')
-        return self
+        upload, _ = cls.objects.update_or_create(content_hash=content_hash, purpose=purpose, defaults={
+            'remote_id': response['id'], 'filename': filename or Path(file_path).name, 'size': Path(file_path).stat().st_size, 'live': True})
+        return upload
 
     def __repr__(self) -> str:
-        return f'<{self.__class__.__name__}: {self.title}>'
+        return f'<{self.__class__.__name__}: {self.filename} {self.remote_id}>'
+
+
+class Job(models.Model):
+    """ A textbook conversion and upload queued for a jobs worker, see jobs.work """
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    file_path = models.CharField(max_length=1024)
+    options = models.JSONField(default=dict, blank=True)  # convert keyword arguments, see Course.sync_textbook
+    state = models.CharField(max_length=16, choices=[(x, x) for x in (QUEUED, RUNNING, DONE, FAILED)], default=QUEUED, db_index=True)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=64, blank=True, null=True)  # worker holding the lease
+    lease_until = models.DateTimeField(blank=True, null=True)  # another worker may take the job over after this
+    result = models.CharField(max_length=64, blank=True, null=True)  # uploaded file id
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    seconds = models.FloatField(blank=True, null=True)  # run time of the last attempt
+
+    @classmethod
+    def enqueue(cls, course: Course, file_path: Path, options: dict = None) -> 'Job':
+        job = cls.objects.create(course=course, file_path=str(Path(file_path).resolve()), options=options or {})
+        logger.info(f'Queued job {job.id}: {file_path} for {course}')
+        return job
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (self.DONE, self.FAILED)
+
+    def __repr__(self) -> str:
+        return f'<{self.__class__.__name__}: {self.id} {self.state}>'
 
 
 class Test(IU_PageElement):
@@ -0,0 +1,174 @@
+""" opt-in profiling of a run: cProfile stats per metrics stage, tracemalloc peak allocation sites, sampled stacks """
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+from ironoxide import settings
+
+logger = logging.getLogger(__file__)
+logger.setLevel(settings.LOGGING_LEVEL_MODULE)
+
+PROFILE_TOP = 15  # functions listed per stage in the profile report
+PROFILE_RUN_STAGE = '(run)'  # time outside any stage
+MEMORY_FRAMES = 4  # traceback depth kept for each allocation, tracing slows the run down in proportion to it
+MEMORY_TOP = 15  # allocation sites listed in the memory report
+MEMORY_SNAPSHOT_GROWTH = 1.2  # a new snapshot is taken when traced memory grows past this factor of the last one
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples of the collapsed-stack file
+
+
+class RunProfiler:
+    """ Profiles a run timed with metrics.Metrics stages, and writes what it found next to the run's output
+
+        Files written, base_path being e.g. the output file:
+            base_path.profile.txt: the top functions of each stage by own time, from cProfile
+            base_path.<stage>.pstats: the full stats of each stage, for pstats, snakeviz or gprof2dot
+            base_path.memory.txt: peak traced memory of each stage and the allocation sites at the run's peak
+            base_path.collapsed: sampled stacks of every thread in the collapsed format of flamegraph.pl and speedscope
+
+        Profiles are exclusive like the stage times: a stage nested in another pauses the outer stage's profile. Only
+        this process is profiled, OCR and extraction worker processes show up as time waiting for them.
+
+        Args:
+            run_metrics(metrics.Metrics): the run, its stages switch the profiles
+            base_path(Path): prefix of the files written
+            profile(bool): cProfile each stage
+            trace_memory(bool): trace allocations with tracemalloc
+            flamegraph(bool): sample stacks every SAMPLE_INTERVAL
+    """
+
+    def __init__(self, run_metrics, base_path: Path, profile: bool = False, trace_memory: bool = False, flamegraph: bool = False):
+        self.run_metrics = run_metrics
+        self.base_path = Path(base_path)
+        self.profiles = {} if profile else None
+        self.trace_memory = trace_memory
+        self.flamegraph = flamegraph
+        self._stack = [PROFILE_RUN_STAGE]
+        self.memory_peaks = Counter()  # stage: peak traced bytes
+        self._snapshot = None
+        self._snapshot_size = 0
+        self._samples = Counter()
+        self._sampler = None
+        self._stop = threading.Event()
+        self._tracing = False  # tracemalloc was started here, and is stopped here
+        self.paths = []
+
+    def __enter__(self):
+        self.run_metrics.profiler = self
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_FRAMES)
+            self._tracing = True
+        if self.flamegraph:
+            self._sampler = threading.Thread(target=self._sample, name='ironoxide-sampler', daemon=True)
+            self._sampler.start()
+        self._enable(PROFILE_RUN_STAGE)
+        return self
+
+    def __exit__(self, *exc):
+        self._disable(PROFILE_RUN_STAGE)
+        self.run_metrics.profiler = None
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+        if self.trace_memory:
+            self._check_memory(PROFILE_RUN_STAGE)
+            if self._tracing:
+                tracemalloc.stop()
+        self.write()
+
+    def _enable(self, stage: str):
+        if self.profiles is not None:
+            self.profiles.setdefault(stage, cProfile.Profile()).enable()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+    def _disable(self, stage: str):
+        if self.profiles is not None:
+            self.profiles[stage].disable()
+        if self.trace_memory:
+            self._check_memory(stage)
+
+    def _check_memory(self, stage: str):
+        current, peak = tracemalloc.get_traced_memory()
+        self.memory_peaks[stage] = max(self.memory_peaks[stage], peak)
+        if current > self._snapshot_size * MEMORY_SNAPSHOT_GROWTH:
+            # snapshots are slow, only taken when memory grew enough for the sites to have changed
+            self._snapshot = tracemalloc.take_snapshot()
+            self._snapshot_size = current
+
+    def enter(self, stage: str):
+        """ Called by Metrics.stage when a stage starts """
+        self._disable(self._stack[-1])
+        self._stack.append(stage)
+        self._enable(stage)
+
+    def exit(self, stage: str):
+        """ Called by Metrics.stage when a stage ends """
+        self._disable(self._stack.pop())
+        self._enable(self._stack[-1])
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                root = [names.get(ident, str(ident))]
+                if ident == threading.main_thread().ident:
+                    root.append(f'stage {self._stack[-1]}')
+                self._samples[';'.join(root + stack[::-1])] += 1
+
+    def _write(self, suffix: str, text: str):
+        path = self.base_path.with_name(f'{self.base_path.name}.{suffix}')
+        path.write_text(text)
+        self.paths.append(path)
+        return path
+
+    def write(self):
+        """ Writes the reports of what was profiled, see the class docstring """
+        self.base_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.profiles is not None:
+            seconds = self.run_metrics.stage_seconds
+            report = io.StringIO()
+            for stage, profile in sorted(self.profiles.items(), key=lambda x: -seconds.get(x[0], 0)):
+                stats = pstats.Stats(profile, stream=report)
+                if not stats.stats:
+                    continue
+                report.write(f'==== {stage}: {seconds.get(stage, 0):.3f}s in the stage, {stats.total_tt:.3f}s profiled\n')
+                stats.sort_stats('tottime').print_stats(PROFILE_TOP)
+                pstats_path = self.base_path.with_name(f'{self.base_path.name}.{stage.strip("()")}.pstats')
+                stats.dump_stats(pstats_path)
+                self.paths.append(pstats_path)
+            self._write('profile.txt', report.getvalue())
+
+        if self.trace_memory:
+            lines = ['peak traced memory by stage:']
+            lines += [f'  {stage:<16} {peak / 2**20:10.1f} MiB' for stage, peak in self.memory_peaks.most_common()]
+            if self._snapshot is not None:
+                snapshot = self._snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>')])
+                lines.append(f'\ntop allocation sites at {self._snapshot_size / 2**20:.1f} MiB traced:')
+                lines += [f'  {stat.size / 2**20:8.2f} MiB {stat.count:>8} blocks  {stat.traceback[0]}' for stat in snapshot.statistics('lineno')[:MEMORY_TOP]]
+                lines.append('\ntracebacks of the largest:')
+                for stat in snapshot.statistics('traceback')[:3]:
+                    lines.append(f'  {stat.size / 2**20:.2f} MiB')
+                    lines += [f'    {line}' for line in stat.traceback.format(most_recent_first=True)]
+            self._write('memory.txt', '\n'.join(lines) + '\n')
+
+        if self.flamegraph:
+            self._write('collapsed', ''.join(f'{stack} {count}\n' for stack, count in sorted(self._samples.items())))
+
+        logger.info(f'Profile written to {", ".join(str(path) for path in self.paths)}')
+        self.run_metrics.info['profile_files'] = [str(path) for path in self.paths]
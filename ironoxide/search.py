@@ -0,0 +1,116 @@
+""" local full-text search over converted documents: a SQLite FTS5 index of their chunks, ranked with bm25 """
+import logging
+import re
+import time
+from pathlib import Path
+
+from ironoxide import settings, sqlitedb
+
+logger = logging.getLogger(__file__)
+logger.setLevel(settings.LOGGING_LEVEL_MODULE)
+
+SEARCH_PATH = settings.DATA_PATH/'search.sqlite3'  # next to the django db.sqlite3
+SEARCH_LIMIT = 10  # hits returned by default
+SEARCH_SNIPPET_TOKENS = 32  # tokens of context in each hit's snippet
+SEARCH_COMMIT_EVERY = 64  # chunks added between commits, each transaction writes a new FTS5 segment that later has to be merged
+_TERM = re.compile(r'\w+')
+
+
+def match_expression(query: str) -> str:
+    """ FTS5 MATCH expression finding chunks with every word of query, so punctuation and FTS5 operators in plain
+        queries are taken literally
+    """
+    return ' '.join(f'"{term}"' for term in _TERM.findall(query))
+
+
+class SearchIndex:
+    """ Full-text index of the chunks of converted documents, tagged with their course and page
+
+        A document is indexed per course (a textbook used by two courses is indexed twice) and identified by its
+        source, the hash of the pdf. Its chunks are added as convert streams them and only count as indexed, see has,
+        once finish is called, so an interrupted conversion is indexed again from scratch the next time.
+
+        Args:
+            path(Path): sqlite database, ':memory:' for a throwaway index
+    """
+
+    def __init__(self, path: Path = SEARCH_PATH):
+        self.db = sqlitedb.connect(path)
+        self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(text, course UNINDEXED, source UNINDEXED, page UNINDEXED, tokenize='porter unicode61')")
+        self.db.execute('CREATE TABLE IF NOT EXISTS documents (course TEXT NOT NULL, source TEXT NOT NULL, path TEXT, chunk_count INTEGER, indexed_at REAL, PRIMARY KEY (course, source))')
+        self.db.commit()
+        self._commits = sqlitedb.BatchedCommits(self.db, SEARCH_COMMIT_EVERY)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def has(self, source: str, course: str) -> bool:
+        """ True if the document was fully indexed for course """
+        return self.db.execute('SELECT 1 FROM documents WHERE course = ? AND source = ?', (course, source)).fetchone() is not None
+
+    def forget(self, source: str, course: str):
+        """ Removes the chunks of a document from course, e.g. before indexing it again """
+        self.db.execute('DELETE FROM chunks WHERE course = ? AND source = ?', (course, source))
+        self.db.execute('DELETE FROM documents WHERE course = ? AND source = ?', (course, source))
+        self.db.commit()
+
+    def add(self, text: str, source: str, course: str, page: int = None):
+        """ Adds a chunk of a document
+
+            Args:
+                text(str): chunk text
+                source(str): the document, e.g. its hash
+                course(str): course the document belongs to
+                page(int): 1-based page the chunk starts on
+        """
+        self.db.execute('INSERT INTO chunks (text, course, source, page) VALUES (?, ?, ?, ?)', (text, course, source, page))
+        self._commits.wrote()
+
+    def finish(self, source: str, course: str, path: Path = None):
+        """ Marks a document as fully indexed for course, after its last chunk was added """
+        chunks, = self.db.execute('SELECT count(*) FROM chunks WHERE course = ? AND source = ?', (course, source)).fetchone()
+        self.db.execute('INSERT OR REPLACE INTO documents (course, source, path, chunk_count, indexed_at) VALUES (?, ?, ?, ?, ?)',
+                        (course, source, str(path) if path else None, chunks, time.time()))
+        self._commits.commit()
+        logger.info(f'Indexed {chunks} chunks of {path or source} for course {course}')
+
+    def search(self, query: str, course: str = None, limit: int = SEARCH_LIMIT, raw: bool = False) -> list:
+        """ Chunks matching query, best first
+
+            Args:
+                query(str): words that must all appear in a chunk (stemmed, case insensitive)
+                course(str): only search the documents of this course, all courses if None
+                limit(int): max number of hits
+                raw(bool): query is an FTS5 MATCH expression (phrases, OR, NEAR, prefix*) instead of plain words
+
+            Returns:
+                list: dicts with the chunk 'text', a 'snippet' with the matches in [brackets], 'course', 'source',
+                    'path', 'page' and the bm25 'score' (lower is better)
+        """
+        expression = query if raw else match_expression(query)
+        if not expression:
+            return []
+        sql = (f"SELECT chunks.text, snippet(chunks, 0, '[', ']', '...', {SEARCH_SNIPPET_TOKENS}), chunks.course, chunks.source, "
+               'documents.path, chunks.page, bm25(chunks) AS score FROM chunks '
+               'LEFT JOIN documents ON documents.course = chunks.course AND documents.source = chunks.source WHERE chunks MATCH ?')
+        params = [expression]
+        if course is not None:
+            sql += ' AND chunks.course = ?'
+            params.append(course)
+        sql += ' ORDER BY score LIMIT ?'
+        params.append(limit)
+        keys = ('text', 'snippet', 'course', 'source', 'path', 'page', 'score')
+        return [dict(zip(keys, row)) for row in self.db.execute(sql, params)]
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def search(query: str, course: str = None, limit: int = SEARCH_LIMIT, raw: bool = False, path: Path = SEARCH_PATH) -> list:
+    """ SearchIndex.search on the index at path """
+    with SearchIndex(path) as index:
+        return index.search(query, course=course, limit=limit, raw=raw)
@@ -0,0 +1,183 @@
+""" single pass sentence segmentation and cleaning of extracted page text, and packing sentences into chunks """
+import functools
+import re
+from typing import Callable, Iterable, Iterator, Pattern
+
+from ironoxide import utils
+
+MIN_WORDS = 5
+MAX_CHARS = 2000
+SENTENCE_END = re.compile(r'\.\n')  # this works best so far
+PACK_SEPARATOR = '. '  # puts back the period the sentence boundary took
+PACK_UNITS = ('chars', 'tokens')
+
+
+class Segmenter:
+    """ Splits a stream of page texts into cleaned sentences in one pass
+
+        Boundaries are found with a compiled regex directly in the page buffer. Words are counted on the buffer
+        (str.count over the sentence's span) and only sentences that pass the filter are sliced out and cleaned, so
+        dropped sentences are never copied. The partial sentence at the end of a page is carried over to the next.
+        feed_pages and close_pages also give the 1-based page each sentence starts on.
+
+        Args:
+            min_words(int): sentences need more than this many space separated words
+            max_chars(int): sentences are cut to this many characters, None to keep them whole
+            boundary(Pattern): compiled regex matching the end of a sentence
+    """
+
+    def __init__(self, min_words: int = MIN_WORDS, max_chars: int = MAX_CHARS, boundary: Pattern = SENTENCE_END):
+        self.min_words = min_words
+        self.max_chars = max_chars
+        self.boundary = boundary
+        self.tail = ''
+        self.page = 0  # pages fed so far
+        self.tail_page = 1  # page the tail starts on
+
+    def _emit(self, buffer: str, start: int, end: int):
+        # more than min_words words means at least min_words separators
+        if buffer.count(' ', start, end) >= self.min_words:
+            return utils.clean_str(buffer[start:end if self.max_chars is None else min(end, start + self.max_chars)])
+        return None
+
+    def feed_pages(self, text: str) -> Iterator[tuple]:
+        """ Adds the text of the next page, yields (page, sentence) of the sentences it completes """
+        self.page += 1
+        carried = len(self.tail)
+        if not self.tail.strip():
+            self.tail_page = self.page
+        buffer = self.tail + text + '\n'
+        start = 0
+        for match in self.boundary.finditer(buffer):
+            sentence = self._emit(buffer, start, match.start())
+            if sentence is not None:
+                yield self.tail_page if start < carried else self.page, sentence
+            start = match.end()
+        if start >= carried:
+            self.tail_page = self.page
+        self.tail = buffer[start:]
+
+    def close_pages(self) -> Iterator[tuple]:
+        """ Yields (page, sentence) of the last sentence, which has no boundary after it """
+        tail, self.tail = self.tail, ''
+        sentence = self._emit(tail, 0, len(tail))
+        if sentence is not None:
+            yield self.tail_page, sentence
+
+    def feed(self, text: str) -> Iterator[str]:
+        """ Adds the text of the next page, yields the sentences it completes """
+        for _, sentence in self.feed_pages(text):
+            yield sentence
+
+    def close(self) -> Iterator[str]:
+        """ Yields the last sentence, which has no boundary after it """
+        for _, sentence in self.close_pages():
+            yield sentence
+
+
+def iter_segments(pages: Iterable[str], min_words: int = MIN_WORDS, max_chars: int = MAX_CHARS, with_pages: bool = False) -> Iterator:
+    """ Splits page texts into cleaned sentences, see Segmenter
+
+        Args:
+            pages(Iterable[str]): text of each page, in order
+            min_words(int): sentences need more than this many space separated words
+            max_chars(int): sentences are cut to this many characters, None to keep them whole
+            with_pages(bool): yield (page, sentence) pairs, page being the 1-based page the sentence starts on
+
+        Yields:
+            str: cleaned sentence, or (int, str) with_pages
+    """
+    segmenter = Segmenter(min_words=min_words, max_chars=max_chars)
+    feed, close = (segmenter.feed_pages, segmenter.close_pages) if with_pages else (segmenter.feed, segmenter.close)
+    for text in pages:
+        yield from feed(text)
+    yield from close()
+
+
+@functools.lru_cache(maxsize=None)
+def _tiktoken_encoding():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding('cl100k_base')
+
+
+def token_length(text: str) -> int:
+    """ Number of tokens in text, counted with tiktoken when it is installed and estimated at 4 characters per token otherwise """
+    encoding = _tiktoken_encoding()
+    if encoding is None:
+        return -(-len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _split_long(sentence: str, budget: int, length: Callable[[str], int]) -> Iterator[str]:
+    """ Splits a sentence longer than budget at spaces (mid-word only for a single overlong word), keeping all of its text """
+    if length(sentence) <= budget:
+        yield sentence
+        return
+    piece = ''
+    for word in sentence.split(' '):
+        candidate = f'{piece} {word}' if piece else word
+        if length(candidate) <= budget:
+            piece = candidate
+            continue
+        if piece:
+            yield piece
+        while length(word) > budget:
+            cut = budget
+            while cut > 1 and length(word[:cut]) > budget:  # tokens can be fewer than chars, shrink until it fits
+                cut -= max(1, cut // 8)
+            yield word[:cut]
+            word = word[cut:]
+        piece = word
+    if piece:
+        yield piece
+
+
+def pack(sentences: Iterable, budget: int = MAX_CHARS, overlap: int = 0, unit: str = 'chars', with_pages: bool = False) -> Iterator:
+    """ Packs consecutive sentences into chunks of up to budget characters or tokens, never dropping or truncating text
+
+        Sentences longer than the budget are split at spaces into several pieces. With overlap, each chunk starts with
+        the last sentences of the previous one, as many as fit in overlap units.
+
+        Args:
+            sentences(Iterable): cleaned sentences, in order, or (page, sentence) pairs with_pages
+            budget(int): max size of a chunk
+            overlap(int): max size of the previous chunk's tail repeated at the start of the next, 0 for none
+            unit(str): 'chars' or 'tokens' (see token_length), what budget and overlap are counted in
+            with_pages(bool): sentences are (page, sentence) pairs (see iter_segments), yield (page, chunk) pairs, page
+                being the page of the chunk's first sentence
+
+        Yields:
+            str: chunk of sentences joined by PACK_SEPARATOR, or (int, str) with_pages
+    """
+    if unit not in PACK_UNITS:
+        raise ValueError(f'Unknown budget unit {unit!r}, expected one of {PACK_UNITS}')
+    length = len if unit == 'chars' else token_length
+    separator = length(PACK_SEPARATOR)
+
+    def packed(chunk):
+        text = PACK_SEPARATOR.join(x for x, _, _ in chunk)
+        return (chunk[0][2], text) if with_pages else text
+
+    chunk = []  # (piece, size, page)
+    size = 0
+    for sentence in sentences:
+        page, sentence = sentence if with_pages else (None, sentence)
+        for piece in _split_long(sentence, budget, length):
+            piece_size = length(piece)
+            if chunk and size + separator + piece_size > budget:
+                yield packed(chunk)
+                # carry the tail of the chunk over, as long as it leaves room for the piece
+                carried, carried_size = [], -separator
+                for x, x_size, x_page in reversed(chunk):
+                    if carried_size + separator + x_size > overlap or carried_size + 2 * separator + x_size + piece_size > budget:
+                        break
+                    carried.insert(0, (x, x_size, x_page))
+                    carried_size += separator + x_size
+                chunk, size = carried, max(carried_size, 0)
+            size += (separator if chunk else 0) + piece_size
+            chunk.append((piece, piece_size, page))
+    if chunk:
+        yield packed(chunk)
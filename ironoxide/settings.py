@@ -9,8 +9,6 @@ import logging
 import os
 from pathlib import Path
 
-import django
-
 # setup
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ironoxide.settings')
 HERE = Path(__file__).parent
@@ -20,15 +18,40 @@ LOGGING_LEVEL_MODULE = logging.DEBUG
 DEBUG = True
 DASH_URL = 'https://mycampus.iubh.de/my/'
 
-# creds
-creds = json.load(open(DATA_PATH/'creds.json', 'r'))
-IU_USER = creds['iu_user']
-IU_PASS = creds['iu_pass']
-OPENAI_API_KEY = creds['openai_api_key']
-os.environ['OPENAI_API_KEY'] = OPENAI_API_KEY
+# creds, read from data/creds.json on first use so converting works without the file
+_CREDS = {'IU_USER': 'iu_user', 'IU_PASS': 'iu_pass', 'OPENAI_API_KEY': 'openai_api_key', 'SECRET_KEY': 'django_secret_key'}  # setting: creds.json key
+_creds = None
+
+
+def _load_creds() -> dict:
+    global _creds
+    if _creds is None:
+        with open(DATA_PATH/'creds.json', 'r') as f:
+            creds = json.load(f)
+        _creds = {name: creds[key] for name, key in _CREDS.items()}
+        os.environ['OPENAI_API_KEY'] = _creds['OPENAI_API_KEY']
+    return _creds
+
+
+def __getattr__(name: str):
+    if name in _CREDS:
+        return _load_creds()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__() -> list:
+    return sorted([*globals(), *_CREDS])  # django reads the settings it finds in dir()
+
+
+def setup_django():
+    """ django.setup(), for code using the models (webautomate, the job queue), not needed to convert """
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
 
 # django
-SECRET_KEY = creds['django_secret_key']
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
@@ -76,5 +99,3 @@ LOGGING = {
         }
     },
 }
-
-django.setup()
@@ -0,0 +1,49 @@
+""" sqlite databases written by concurrent conversions: the conversion cache, the dedup and the search index """
+import sqlite3
+from pathlib import Path
+
+SQLITE_TIMEOUT = 30  # seconds a connection waits for another conversion's write lock before giving up
+
+
+def connect(path=None) -> sqlite3.Connection:
+    """ Opens a database file in WAL mode, so readers don't block the writer nor each other
+
+        Args:
+            path(Path, str): database file, None or ':memory:' for a throwaway database (no WAL needed)
+
+        Returns:
+            sqlite3.Connection: the connection
+    """
+    in_memory = path is None or str(path) == ':memory:'
+    if not in_memory:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(':memory:' if in_memory else path, timeout=SQLITE_TIMEOUT)
+    if not in_memory:
+        db.execute('PRAGMA journal_mode=WAL')
+    return db
+
+
+class BatchedCommits:
+    """ Commits a connection once every so many writes instead of after each one, or of the whole run
+
+        A commit per write costs an fsync each, one at the end holds the write lock for the whole conversion.
+
+        Args:
+            db(sqlite3.Connection): connection written to
+            every(int): writes between commits
+    """
+
+    def __init__(self, db: sqlite3.Connection, every: int):
+        self.db = db
+        self.every = every
+        self.uncommitted = 0
+
+    def wrote(self):
+        """ Counts a write, committing if it is the every-th since the last commit """
+        self.uncommitted += 1
+        if self.uncommitted >= self.every:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.uncommitted = 0
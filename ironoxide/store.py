@@ -0,0 +1,229 @@
+""" output backends for converted chunks: plain or compressed jsonl, and a memory-mappable chunk store """
+import gzip
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+import uuid
+from array import array
+from pathlib import Path
+
+FORMATS = {  # output format: file suffix
+    'jsonl': '.jsonl',
+    'gzip': '.jsonl.gz',
+    'zstd': '.jsonl.zst',
+    'chunks': '.chunks',
+}
+
+STDOUT = '-'  # output path that streams the records to stdout instead of a file
+CHUNKS_MAGIC = b'IOXCHNK1'
+CHUNKS_HEADER = struct.Struct('<8sQQ')  # magic, chunk count, offset of the offsets array
+
+
+def format_for(path) -> str:
+    """ Guesses the output format from a file name, defaults to jsonl """
+    name = str(path)
+    for output_format, suffix in sorted(FORMATS.items(), key=lambda x: -len(x[1])):
+        if name.endswith(suffix):
+            return output_format
+    return 'jsonl'
+
+
+def output_name(file_path: Path, output_format: str = 'jsonl') -> str:
+    """ Name of the output for file_path, unique per source so same-named pdfs in different folders don't collide """
+    return f'{Path(file_path).stem}-{hashlib.sha1(str(file_path).encode()).hexdigest()[:8]}{FORMATS[output_format]}'
+
+
+class AtomicWriter:
+    """ Base of the writers: the output is written to a temporary file next to path and renamed over it once complete
+
+        Readers never see a half-written output, and conversions writing the same path at once each write their own
+        temporary file, the last one to finish wins. Exiting the context on an error drops the temporary file instead.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp_path = self.path.with_name(f'.{self.path.name}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp')  # opened by the writer
+
+    def _close(self):
+        raise NotImplementedError
+
+    def close(self):
+        """ Finishes the output and moves it into place """
+        self._close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """ Drops the partial output, path keeps its previous content if it had any """
+        try:
+            self._close()
+        finally:
+            self.tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class JsonlWriter(AtomicWriter):
+    """ Writes one json record per line, optionally gzip or zstd compressed, to a file or to stdout (path STDOUT)
+
+        On stdout each record is flushed as soon as it is written, so the output can be piped into another tool while
+        the conversion runs.
+    """
+
+    def __init__(self, path, compression: str = None):
+        if compression not in (None, 'gzip', 'zstd'):
+            raise ValueError(f'Unknown compression {compression!r}')
+        if compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError as e:
+                raise ImportError('zstd output needs the zstandard package, pip install zstandard') from e
+        self.compression = compression
+        self.stdout = str(path) == STDOUT
+        if self.stdout:
+            self.path = self.tmp_path = None
+            self._raw = None
+            raw = sys.stdout.buffer
+        else:
+            super().__init__(path)
+            raw = self._raw = open(self.tmp_path, 'wb')
+        if compression is None:
+            self.f = io.TextIOWrapper(raw, encoding='utf-8')
+        elif compression == 'gzip':
+            self.f = gzip.open(raw, 'wt', compresslevel=6)  # doesn't close raw
+        else:
+            self.f = io.TextIOWrapper(zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=False), encoding='utf-8')
+
+    def write(self, record: dict):
+        self.f.write(json.dumps(record) + '\n')
+        if self.stdout:
+            self.f.flush()
+
+    def _close(self):
+        if self.stdout and self.compression is None:
+            self.f.detach()  # flushes, and leaves stdout open
+        else:
+            self.f.close()
+        if self._raw is not None:
+            self._raw.close()
+        else:
+            sys.stdout.buffer.flush()
+
+    def close(self):
+        if self.stdout:
+            self._close()
+        else:
+            super().close()
+
+    def abort(self):
+        if self.stdout:
+            self._close()
+        else:
+            super().abort()
+
+
+class ChunkStoreWriter(AtomicWriter):
+    """ Writes chunk texts as one utf-8 blob followed by an array of offsets into it
+
+        Layout: header (magic, count, offsets position), the blob, then count + 1 little endian uint64 offsets,
+        so chunk i is blob[offsets[i]:offsets[i + 1]]. Only the 'text' of each record is stored.
+    """
+
+    def __init__(self, path):
+        if str(path) == STDOUT:
+            raise ValueError('A chunk store is written with seeks, it can only go to a file')
+        super().__init__(path)
+        self.f = open(self.tmp_path, 'wb')
+        self.f.write(CHUNKS_HEADER.pack(CHUNKS_MAGIC, 0, 0))
+        self.offsets = array('Q', [CHUNKS_HEADER.size])
+
+    @property
+    def count(self) -> int:
+        return len(self.offsets) - 1
+
+    def write(self, record: dict):
+        data = record['text'].encode('utf-8')
+        self.f.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def _close(self):
+        offsets_position = self.offsets[-1]
+        if sys.byteorder != 'little':
+            self.offsets.byteswap()
+        self.offsets.tofile(self.f)
+        self.f.seek(0)
+        self.f.write(CHUNKS_HEADER.pack(CHUNKS_MAGIC, self.count, offsets_position))
+        self.f.close()
+
+
+class ChunkStore:
+    """ Random access to the chunks of a chunk store file, memory-mapped so nothing is read until a chunk is asked for
+
+        Usage:
+            with ChunkStore(path) as chunks:
+                len(chunks), chunks[i], chunks[-1], list(chunks)
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, self._offsets_position = CHUNKS_HEADER.unpack_from(self._mm, 0)
+        if magic != CHUNKS_MAGIC:
+            raise ValueError(f'{self.path} is not a chunk store')
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError('chunk index out of range')
+        start, end = struct.unpack_from('<QQ', self._mm, self._offsets_position + 8 * i)
+        return self._mm[start:end].decode('utf-8')
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_writer(path, output_format: str = None):
+    """ Opens a writer for converted records
+
+        Args:
+            path(PosixPath, str): output file, STDOUT to stream jsonl (or compressed jsonl) records to stdout
+            output_format(str): one of FORMATS, guessed from the file name if None
+
+        Returns:
+            JsonlWriter or ChunkStoreWriter: writer with write(record) and close(), usable as a context manager
+    """
+    output_format = output_format or format_for(path)
+    if output_format == 'jsonl':
+        return JsonlWriter(path)
+    if output_format in ('gzip', 'zstd'):
+        return JsonlWriter(path, compression=output_format)
+    if output_format == 'chunks':
+        return ChunkStoreWriter(path)
+    raise ValueError(f'Unknown output format {output_format!r}, expected one of {list(FORMATS)}')
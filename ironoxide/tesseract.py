@@ -0,0 +1,98 @@
+""" tesseract engines that keep the model loaded across pages instead of starting tesseract for every page """
+import logging
+import subprocess
+import tempfile
+from pathlib import Path
+
+from ironoxide import settings, utils
+
+pytesseract = utils.lazy_import('pytesseract')  # so the CLI can read OCR_ENGINES without loading it
+
+logger = logging.getLogger(__file__)
+logger.setLevel(settings.LOGGING_LEVEL_MODULE)
+
+OCR_LANG = 'eng'
+OCR_OEM = 1  # LSTM only
+OCR_ENGINES = ('auto', 'tesserocr', 'batch', 'pytesseract')
+
+
+class PytesseractEngine:
+    """ One tesseract process per page through pytesseract, reloading the model every time """
+
+    def recognize(self, images: list) -> list:
+        return [pytesseract.image_to_string(str(image) if isinstance(image, Path) else image, lang=OCR_LANG, config=f'--oem {OCR_OEM}') for image in images]
+
+    def close(self):
+        pass
+
+
+class BatchEngine:
+    """ One tesseract process per batch of pages, passed as a list file so the model is loaded once per batch """
+
+    def recognize(self, images: list) -> list:
+        if not images:
+            return []
+        with tempfile.TemporaryDirectory(prefix='ironoxide_tesseract_') as tmp:
+            paths = []
+            for i, image in enumerate(images):
+                if isinstance(image, (str, Path)):
+                    paths.append(str(image))
+                else:
+                    # uncompressed netpbm: writing it is a copy, the fastest png still costs ~60ms for a 200 dpi page
+                    paths.append(f'{tmp}/{i}.pnm')
+                    (image if image.mode in ('1', 'L', 'RGB') else image.convert('RGB')).save(paths[-1], format='PPM')
+            list_path = Path(tmp)/'pages.txt'
+            list_path.write_text('\n'.join(paths) + '\n')
+            result = subprocess.run([pytesseract.pytesseract.tesseract_cmd, str(list_path), 'stdout', '-l', OCR_LANG, '--oem', str(OCR_OEM)],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        texts = result.stdout.decode('utf-8').split('\f')  # tesseract ends each page with a form feed
+        if len(texts) < len(images):
+            raise RuntimeError(f'tesseract returned {len(texts)} pages for {len(images)} images: {result.stderr.decode(errors="replace")}')
+        return [text + '\f' for text in texts[:len(images)]]
+
+    def close(self):
+        pass
+
+
+class TesserocrEngine:
+    """ tesseract's C++ API kept loaded in this process through the optional tesserocr package """
+
+    def __init__(self):
+        import tesserocr
+        self.api = tesserocr.PyTessBaseAPI(lang=OCR_LANG, oem=OCR_OEM)
+
+    def recognize(self, images: list) -> list:
+        texts = []
+        for image in images:
+            if isinstance(image, (str, Path)):
+                self.api.SetImageFile(str(image))
+            else:
+                self.api.SetImage(image)
+            texts.append(self.api.GetUTF8Text())
+        return texts
+
+    def close(self):
+        self.api.End()
+
+
+def get_engine(name: str = 'auto'):
+    """ Creates an OCR engine
+
+        Args:
+            name(str): one of OCR_ENGINES, 'auto' picks tesserocr when it is installed and batch otherwise
+
+        Returns:
+            engine with recognize(images) -> texts, images being PIL images or paths, and close()
+    """
+    if name == 'auto':
+        try:
+            return TesserocrEngine()
+        except ImportError:
+            return BatchEngine()
+    if name == 'tesserocr':
+        return TesserocrEngine()
+    if name == 'batch':
+        return BatchEngine()
+    if name == 'pytesseract':
+        return PytesseractEngine()
+    raise ValueError(f'Unknown OCR engine {name!r}, expected one of {OCR_ENGINES}')
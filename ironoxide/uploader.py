@@ -0,0 +1,221 @@
+""" upload client: pooled connections, multipart bodies streamed from disk, retries with backoff on 429 and 5xx """
+import logging
+import mimetypes
+import random
+import time
+import uuid
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ironoxide import metrics, settings
+
+logger = logging.getLogger(__file__)
+logger.setLevel(settings.LOGGING_LEVEL_MODULE)
+
+UPLOAD_BASE_URL = 'https://api.openai.com/v1'
+UPLOAD_CONNECT_TIMEOUT = 10  # seconds to connect
+UPLOAD_READ_TIMEOUT = 300  # seconds to wait for each read of the response, the server may take a while to accept a large file
+UPLOAD_RETRIES = 5  # attempts after the first one
+UPLOAD_BACKOFF = 1  # seconds, the base of the exponential backoff..
+UPLOAD_BACKOFF_MAX = 60  # ..and its cap, retries wait a random time up to min(cap, base * 2**attempt)
+UPLOAD_RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')  # read timeouts are only retried for these
+UPLOAD_POOL_SIZE = 4  # connections kept open per host
+UPLOAD_CHUNK_SIZE = 2**16  # bytes read from the file at a time
+
+
+class MultipartFile:
+    """ multipart/form-data body of some form fields and one file, read from disk as it is sent
+
+        Its length is known up front, so requests sends a Content-Length instead of a chunked body, and it can be
+        iterated again to resend it on a retry.
+
+        Args:
+            file_path(Path): file to send
+            fields(dict): form fields sent before the file
+            field(str): form field of the file
+            filename(str): file name sent with the file, file_path's name if None
+    """
+
+    def __init__(self, file_path: Path, fields: dict = None, field: str = 'file', filename: str = None):
+        self.file_path = Path(file_path)
+        self.boundary = uuid.uuid4().hex
+        filename = (filename or self.file_path.name).replace('"', '%22')
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        head = [f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n' for name, value in (fields or {}).items()]
+        head.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n')
+        self.head = ''.join(head).encode()
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode()
+        self.file_size = self.file_path.stat().st_size
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self) -> int:
+        return len(self.head) + self.file_size + len(self.tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self.head
+        with open(self.file_path, 'rb') as f:
+            while chunk := f.read(UPLOAD_CHUNK_SIZE):
+                yield chunk
+        yield self.tail
+
+
+class UploadClient:
+    """ HTTP client for uploads, one per process is enough: connections are pooled and reused across calls
+
+        Requests that fail to connect, time out connecting, or get a 429 or 5xx response are retried with exponential
+        backoff and full jitter, or after the Retry-After the server asked for. A read timeout is only retried for
+        IDEMPOTENT_METHODS: the server may have accepted a POST it was slow to answer, and sending it again would create
+        a second remote file. Such an upload fails instead, and the next Upload.upload of the file sends it again
+        (the server may then hold both copies).
+
+        Args:
+            base_url(str): prefix of the request paths
+            api_key(str): bearer token, settings.OPENAI_API_KEY if None
+            timeout(tuple): (connect, read) timeouts in seconds
+            retries(int): attempts after the first one
+            backoff(float): base of the backoff in seconds
+            backoff_max(float): longest wait between attempts in seconds
+            pool_size(int): connections kept open per host
+    """
+
+    def __init__(self, base_url: str = UPLOAD_BASE_URL, api_key: str = None, timeout: tuple = (UPLOAD_CONNECT_TIMEOUT, UPLOAD_READ_TIMEOUT),
+                 retries: int = UPLOAD_RETRIES, backoff: float = UPLOAD_BACKOFF, backoff_max: float = UPLOAD_BACKOFF_MAX, pool_size: int = UPLOAD_POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)  # retried here, urllib3 can't resend a streamed body
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _wait(self, attempt: int, response: requests.Response = None) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass  # an HTTP date, fall back to the backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def request(self, method: str, path: str, run_metrics: metrics.Metrics = None, **kwargs) -> requests.Response:
+        """ Sends a request, retrying it on connection errors, timeouts, 429 and 5xx
+
+            Args:
+                method(str): HTTP method
+                path(str): appended to base_url
+                run_metrics(metrics.Metrics): counts the retries
+                **kwargs: passed on to requests.Session.request, data may be a MultipartFile
+
+            Returns:
+                requests.Response: the last response, check it with raise_for_status
+
+            Raises:
+                requests.ConnectionError, requests.Timeout: the last attempt failed to connect or timed out, or a
+                    non-idempotent request timed out waiting for the response
+        """
+        headers = {'Authorization': f'Bearer {self.api_key or settings.OPENAI_API_KEY}', **kwargs.pop('headers', {})}
+        if isinstance(kwargs.get('data'), MultipartFile):
+            headers['Content-Type'] = kwargs['data'].content_type
+        url = f'{self.base_url}/{path.lstrip("/")}'
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries or (isinstance(e, requests.ReadTimeout) and method.upper() not in IDEMPOTENT_METHODS):
+                    raise
+                reason = repr(e)
+            else:
+                if response.status_code not in UPLOAD_RETRY_STATUSES or attempt == self.retries:
+                    return response
+                reason = f'HTTP {response.status_code}'
+                response.close()  # give the connection back to the pool
+            wait = self._wait(attempt, response)
+            logger.warning(f'{method} {url} failed ({reason}), retry {attempt + 1}/{self.retries} in {wait:.1f}s')
+            if run_metrics is not None:
+                run_metrics.count('upload_retries')
+            time.sleep(wait)
+
+    def upload_file(self, file_path: Path, purpose: str = 'answers', filename: str = None, run_metrics: metrics.Metrics = None) -> dict:
+        """ Uploads a file to the files endpoint, streaming it from disk
+
+            Args:
+                file_path(Path): file to upload
+                purpose(str): what the file is for
+                filename(str): name to give the uploaded file, file_path's name if None
+                run_metrics(metrics.Metrics): records the upload time, bytes sent, retries and failures
+
+            Returns:
+                dict: the uploaded file object, with its 'id' and 'status'
+
+            Raises:
+                requests.HTTPError: the upload failed, after retrying
+        """
+        body = MultipartFile(file_path, fields={'purpose': purpose}, filename=filename)
+        with run_metrics.stage('upload') if run_metrics is not None else nullcontext():
+            response = self.request('POST', 'files', data=body, run_metrics=run_metrics)
+        if run_metrics is not None:
+            run_metrics.count('uploads' if response.ok else 'upload_failures')
+            run_metrics.count('bytes_out', len(body))
+        response.raise_for_status()
+        return response.json()
+
+    def file_exists(self, file_id: str, run_metrics: metrics.Metrics = None) -> bool:
+        """ Checks the files endpoint still has a file uploaded earlier
+
+            Args:
+                file_id(str): the file's id
+                run_metrics(metrics.Metrics): counts the retries
+
+            Returns:
+                bool: False if the server answers 404, the file was deleted
+
+            Raises:
+                requests.HTTPError: any other error, after retrying
+        """
+        response = self.request('GET', f'files/{file_id}', run_metrics=run_metrics)
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+
+
+def client() -> UploadClient:
+    """ The process' shared UploadClient, so uploads reuse its pooled connections """
+    global _client
+    if _client is None:
+        _client = UploadClient()
+    return _client
+
+
+def upload_file(file_path: Path, purpose: str = 'answers', filename: str = None, run_metrics: metrics.Metrics = None) -> dict:
+    """ UploadClient.upload_file with the shared client """
+    return client().upload_file(file_path, purpose=purpose, filename=filename, run_metrics=run_metrics)
+
+
+def file_exists(file_id: str, run_metrics: metrics.Metrics = None) -> bool:
+    """ UploadClient.file_exists with the shared client """
+    return client().file_exists(file_id, run_metrics=run_metrics)
@@ -1,4 +1,10 @@
+import importlib.util
+import queue
+import sys
+import threading
 import unicodedata
+from typing import Iterable, Iterator
+
 
 def clean_str(s: str):
     """ custom string cleaner, returns normalized unicode with spaces trimmed
@@ -9,4 +15,103 @@ def clean_str(s: str):
         Returns:
             string(str): normalized unicode string with spaces trimmed
     """
-    return unicodedata.normalize('NFC', str(s.strip()))
+    s = str(s.strip())
+    if s.isascii():  # ascii is always NFC
+        return s
+    return unicodedata.normalize('NFC', s)
+
+
+def lazy_import(name: str):
+    """ Module that is only actually imported when one of its attributes is first used, for heavy libraries only
+        some code paths need
+
+        Args:
+            name(str): absolute module name, e.g. 'pdfplumber' or 'PIL.Image'
+
+        Returns:
+            module: the module, already imported if something else imported it before
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    spec.loader.exec_module(module)
+    return module
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    """ Groups items into lists of size items, the last one possibly shorter
+
+        Args:
+            iterable(Iterable): items to group
+            size(int): items per list
+
+        Yields:
+            list: next group of items
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(iterable: Iterable, maxsize: int) -> Iterator:
+    """ Consumes iterable in a background thread, buffering at most maxsize items ahead of the caller
+
+        Lets a slow producer (e.g. rendering pdf pages) overlap with a slow consumer while keeping memory capped.
+        Exceptions raised by the producer are re-raised in the caller. Closing the generator stops the producer.
+
+        Args:
+            iterable(Iterable): items to produce
+            maxsize(int): max number of items buffered
+
+        Yields:
+            items of iterable, in order
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put((done, e))
+            return
+        put((done, None))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if isinstance(item, tuple) and len(item) == 2 and item[0] is done:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
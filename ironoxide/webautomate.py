@@ -14,6 +14,8 @@ from selenium.webdriver.support.ui import WebDriverWait
 from thefuzz import process
 
 from ironoxide import settings
+
+settings.setup_django()
 from ironoxide.models import Answer, Course, Question, Test
 
 # TODO: id like to add colour to the logging
@@ -0,0 +1,110 @@
+""" worker process pool sized to the CPUs this process may actually use, shared by the documents of a run """
+import logging
+import math
+import os
+from multiprocessing.pool import Pool
+from multiprocessing.util import Finalize
+
+from ironoxide import settings
+
+logger = logging.getLogger(__file__)
+logger.setLevel(settings.LOGGING_LEVEL_MODULE)
+
+CGROUP_V2_CPU_MAX = '/sys/fs/cgroup/cpu.max'
+CGROUP_V1_CPU_QUOTA = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+CGROUP_V1_CPU_PERIOD = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+
+_job_pool = None  # OCR pool of a batch or jobs worker process, shared by every document it converts, see init_job_pool
+
+
+def cpu_quota() -> float:
+    """ CPUs allowed by the cgroup CPU quota (docker --cpus, kubernetes limits), None if there is no quota """
+    try:
+        with open(CGROUP_V2_CPU_MAX) as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == 'max' else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(CGROUP_V1_CPU_QUOTA) as f, open(CGROUP_V1_CPU_PERIOD) as g:
+            quota, period = int(f.read()), int(g.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    """ CPUs this process can run on: its affinity mask (or os.cpu_count()) capped by the cgroup quota, at least 1 """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    quota = cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+class WorkerPool:
+    """ multiprocessing Pool started on first use, so holding one costs nothing until a document needs it
+
+        Exiting the context closes the pool and waits for its workers once their tasks are done, or terminates them if
+        the block raised.
+
+        Args:
+            processes(int): worker processes, None for available_cpus()
+    """
+
+    def __init__(self, processes: int = None):
+        self.processes = processes or available_cpus()
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    @property
+    def pool(self) -> Pool:
+        if self._pool is None:
+            logger.debug(f'Starting {self.processes} worker processes')
+            self._pool = Pool(processes=self.processes)
+        return self._pool
+
+    def imap(self, func, iterable, chunksize: int = 1):
+        """ Pool.imap: results in the order of iterable, each as soon as it and the ones before it are done """
+        return self.pool.imap(func, iterable, chunksize)
+
+    def apply_async(self, func, args=(), kwds=None):
+        return self.pool.apply_async(func, args, kwds or {})
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def terminate(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+def init_job_pool(processes: int):
+    """ ProcessPoolExecutor initializer of the batch and jobs worker processes: one WorkerPool for all their documents
+
+        The pool is closed, letting its workers finish and exit, when the worker process exits.
+
+        Args:
+            processes(int): worker processes of the pool, see WorkerPool
+    """
+    global _job_pool
+    _job_pool = WorkerPool(processes)
+    Finalize(_job_pool, _job_pool.close, exitpriority=20)
+
+
+def job_pool() -> WorkerPool:
+    """ The pool init_job_pool started in this process, None outside of a batch or jobs worker """
+    return _job_pool
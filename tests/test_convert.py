@@ -0,0 +1,31 @@
+""" convert's page extraction on documents of the synthetic benchmark corpus """
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from benchmarks import corpus
+
+ROOT = Path(__file__).parent.parent
+
+PEAK_RSS = """
+import resource, sys
+from ironoxide import convert
+for text in convert.iter_pages_text(sys.argv[1], text_backend=sys.argv[2]):
+    pass
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def peak_rss(file_path: Path, text_backend: str) -> int:
+    """ Peak RSS in KiB of a fresh interpreter reading every page of a pdf """
+    result = subprocess.run([sys.executable, '-c', PEAK_RSS, str(file_path), text_backend], cwd=ROOT, capture_output=True, text=True, check=True)
+    return int(result.stdout)
+
+
+@pytest.mark.parametrize('text_backend', ['pdfplumber', 'pdfminer'])
+def test_memory_does_not_grow_with_the_page_count(tmp_path, text_backend):
+    short, long = corpus.generate('text', 10, out=tmp_path), corpus.generate('text', 100, out=tmp_path)
+    growth = peak_rss(long, text_backend) - peak_rss(short, text_backend)
+    assert growth < 20 * 1024  # 90 more pages, holding on to each page's layout took over 200 MiB
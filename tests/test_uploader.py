@@ -0,0 +1,182 @@
+""" uploader.UploadClient against a local stand-in of the files endpoint, an http.server on 127.0.0.1 """
+import json
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from ironoxide import metrics, uploader
+
+
+class StandIn(ThreadingHTTPServer):
+    """ Answers each request with the next scripted (status, headers, delay) reply, 200 with a file object once they run out
+
+        Attributes:
+            received(list): dicts with the 'method', 'path', 'headers', 'body' and client 'port' of each request
+    """
+    daemon_threads = True
+
+    def __init__(self, replies: list = ()):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.replies = list(replies)
+        self.received = []
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/v1'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse shows as one client port
+
+    def do_POST(self):
+        self._reply()
+
+    def do_GET(self):
+        self._reply()
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        self.server.received.append({'method': self.command, 'path': self.path, 'headers': dict(self.headers), 'body': body,
+                                     'port': self.client_address[1]})
+        status, headers, delay = self.server.replies.pop(0) if self.server.replies else (200, {}, 0)
+        threading.Event().wait(delay)  # not time.sleep, the waits fixture replaces it
+        payload = json.dumps({'id': f'file-{len(self.server.received)}', 'status': 'uploaded'} if status == 200 else {'error': status}).encode()
+        try:
+            self.send_response(status)
+            for name, value in {'Content-Type': 'application/json', 'Content-Length': str(len(payload)), **headers}.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):  # the client timed out and hung up
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(request):
+    stand_in = StandIn(getattr(request, 'param', ()))
+    thread = threading.Thread(target=stand_in.serve_forever, daemon=True)
+    thread.start()
+    yield stand_in
+    stand_in.shutdown()
+    stand_in.server_close()
+
+
+@pytest.fixture
+def waits(monkeypatch):
+    """ Backoff waits the client asked for, without sleeping through them """
+    slept = []
+    monkeypatch.setattr(uploader.time, 'sleep', slept.append)
+    return slept
+
+
+@pytest.fixture
+def upload(tmp_path):
+    path = tmp_path/'book.jsonl'
+    path.write_bytes(os.urandom(300_000) + b'\r\n--not-the-boundary--\r\n')
+    return path
+
+
+def client(server, **kwargs) -> uploader.UploadClient:
+    return uploader.UploadClient(base_url=server.url, api_key='test-key', **{'timeout': (1, 2), **kwargs})
+
+
+def file_part(received: dict) -> bytes:
+    """ The file's bytes in a multipart body received by the stand-in """
+    boundary = received['headers']['Content-Type'].split('boundary=')[1].encode()
+    body = received['body']
+    assert body.endswith(b'\r\n--' + boundary + b'--\r\n')
+    start = body.index(b'\r\n\r\n', body.index(b'filename="')) + 4
+    return body[start:-len(b'\r\n--' + boundary + b'--\r\n')]
+
+
+@pytest.mark.parametrize('server', [[(429, {'Retry-After': '3'}, 0), (503, {}, 0)]], indirect=True)
+def test_retries_429_and_5xx_honouring_retry_after(server, waits, upload):
+    run_metrics = metrics.Metrics('test')
+    with client(server, backoff=0.5) as c:
+        result = c.upload_file(upload, purpose='answers', run_metrics=run_metrics)
+    assert result == {'id': 'file-3', 'status': 'uploaded'}
+    assert len(server.received) == 3
+    assert waits[0] == 3  # as the server asked
+    assert 0 <= waits[1] <= 0.5 * 2  # backoff of the second attempt
+    assert run_metrics.counters['upload_retries'] == 2
+    assert run_metrics.counters['uploads'] == 1
+    assert all(file_part(received) == upload.read_bytes() for received in server.received)
+
+
+@pytest.mark.parametrize('server', [[(503, {}, 0)] * 3], indirect=True)
+def test_gives_up_after_the_retries(server, waits, upload):
+    run_metrics = metrics.Metrics('test')
+    with client(server, retries=2) as c, pytest.raises(requests.HTTPError) as error:
+        c.upload_file(upload, run_metrics=run_metrics)
+    assert error.value.response.status_code == 503
+    assert len(server.received) == 3
+    assert len(waits) == 2
+    assert run_metrics.counters['upload_failures'] == 1
+
+
+def test_streams_the_body_with_a_content_length(server, upload):
+    with client(server) as c:
+        c.upload_file(upload, purpose='answers', filename='course-1.jsonl')
+    received, = server.received
+    assert received['path'] == '/v1/files'
+    assert received['headers']['Authorization'] == 'Bearer test-key'
+    assert 'Transfer-Encoding' not in received['headers']
+    assert int(received['headers']['Content-Length']) == len(received['body'])
+    assert b'name="purpose"\r\n\r\nanswers\r\n' in received['body']
+    assert b'filename="course-1.jsonl"' in received['body']
+    assert file_part(received) == upload.read_bytes()
+
+
+def test_reuses_the_connection(server, upload):
+    with client(server) as c:
+        for _ in range(3):
+            c.upload_file(upload)
+    assert len({received['port'] for received in server.received}) == 1
+
+
+@pytest.mark.parametrize('server', [[(200, {}, 1)]], indirect=True)
+def test_does_not_retry_a_post_that_timed_out_reading(server, waits, upload):
+    with client(server, timeout=(1, 0.2)) as c, pytest.raises(requests.ReadTimeout):
+        c.upload_file(upload)
+    assert len(server.received) == 1  # the server may have accepted it, sending it again could duplicate the file
+    assert waits == []
+
+
+@pytest.mark.parametrize('server', [[(200, {}, 1)]], indirect=True)
+def test_retries_an_idempotent_request_that_timed_out_reading(server, waits):
+    with client(server, timeout=(1, 0.2)) as c:
+        response = c.request('GET', 'files/file-1')
+    assert response.ok
+    assert len(server.received) == 2
+    assert len(waits) == 1
+
+
+@pytest.mark.parametrize('server', [[(200, {}, 0), (404, {}, 0)]], indirect=True)
+def test_tells_deleted_files_apart(server):
+    with client(server) as c:
+        assert c.file_exists('file-1')
+        assert not c.file_exists('file-2')
+    assert [received['path'] for received in server.received] == ['/v1/files/file-1', '/v1/files/file-2']
+
+
+@pytest.mark.parametrize('server', [[(500, {}, 0)] * 2], indirect=True)
+def test_file_exists_raises_other_errors(server, waits):
+    with client(server, retries=1) as c, pytest.raises(requests.HTTPError):
+        c.file_exists('file-1')
+
+
+def test_retries_failed_connections_then_raises(waits, upload):
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))  # bound but not listening, connections are refused
+        url = f'http://127.0.0.1:{unused.getsockname()[1]}/v1'
+        with uploader.UploadClient(base_url=url, api_key='test-key', retries=2) as c, pytest.raises(requests.ConnectionError):
+            c.upload_file(upload)
+    assert len(waits) == 2